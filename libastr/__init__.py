@@ -7,12 +7,44 @@
 import sys
 if sys.version_info[0] < 3:
     raise Exception("Must be using Python 3")
-else:
+
+name = "lib-python-astr"
+
+# Public objects and the submodule defining them. Submodules (and their
+# dependencies such as requests) are only imported on first access, to keep
+# "import libastr" cheap for short-lived scripts.
+_LAZY_OBJECTS = {
+    "Browser": "resources",
+    "Archive": "resources",
+    "ArchiveCategory": "resources",
+    "AstrClient": "client",
+    "ArchiveFrame": "frame",
+    "DescriptorValidator": "validation",
+    "RequestScheduler": "scheduler",
+    "PRIORITY_INTERACTIVE": "scheduler",
+    "PRIORITY_DEFAULT": "scheduler",
+    "PRIORITY_BULK": "scheduler",
+}
+
+__all__ = sorted(_LAZY_OBJECTS)
+
+
+def __getattr__(attr):
+    try:
+        module_name = _LAZY_OBJECTS[attr]
+    except KeyError:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, attr))
     try:
-        from .resources import Browser, Archive, ArchiveCategory
-        from .client import AstrClient
+        import importlib
+        module = importlib.import_module("." + module_name, __name__)
     except ImportError as e:
         errmsg = "Can't import the library"
         raise Exception(errmsg).with_traceback(e.__traceback__)
+    value = getattr(module, attr)
+    # Cache the object so that __getattr__ is not called again
+    globals()[attr] = value
+    return value
 
-name = "lib-python-astr"
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,432 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""libastr command-line tool (astr) for bulk operations on ASTR.
+
+Query results and operation results are written to stdout as JSON lines,
+so that commands can be chained, e.g.:
+
+    astr query --category MY_CAT | astr download /data/archives --jobs 8
+
+Errors and the final summary are written to stderr.
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+from .logger import get_logger
+
+DEFAULT_JOBS = 4
+
+
+# - [ Summary ] --------------------------------------------------------------
+
+class _Summary(object):
+    """Count succeeded and failed items and transferred bytes of a command."""
+
+    def __init__(self, command):
+        self.command = command
+        self.succeeded = 0
+        self.failed = 0
+        self.bytes = 0
+        self._start = time.monotonic()
+
+    def success(self, nb_bytes=0):
+        self.succeeded += 1
+        self.bytes += nb_bytes
+
+    def failure(self, item, error):
+        self.failed += 1
+        sys.stderr.write("error: {}: {}\n".format(item, error))
+
+    def report(self):
+        """Write the summary line to stderr."""
+        elapsed = time.monotonic() - self._start
+        total = self.succeeded + self.failed
+        msg = "{}: {} succeeded, {} failed in {:.1f}s ({:.1f} items/s".format(
+            self.command, self.succeeded, self.failed, elapsed,
+            total / elapsed if elapsed > 0 else 0.0)
+        if self.bytes:
+            msg += ", {:.2f} MB/s".format(
+                self.bytes / 1e6 / elapsed if elapsed > 0 else 0.0)
+        sys.stderr.write(msg + ")\n")
+
+
+# - [ Helpers ] --------------------------------------------------------------
+
+def _run_parallel(func, items, jobs):
+    """Call func on every item with a pool of threads.
+
+    At most 2 * jobs items are consumed in advance, so that items can be
+    streamed (e.g. from stdin) with bounded memory.
+
+    Args:
+        func (callable): function called with one item
+        items (iterable): items to process
+        jobs (int): number of threads
+
+    Yields:
+        (tuple) item, result of func (None if failed) and exception (None if
+          succeeded), in completion order
+    """
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = {}
+        items = iter(items)
+        exhausted = False
+        while pending or not exhausted:
+            while not exhausted and len(pending) < 2 * jobs:
+                try:
+                    item = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending[executor.submit(func, item)] = item
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = pending.pop(future)
+                error = future.exception()
+                yield item, None if error else future.result(), error
+
+
+def _read_ids(ids, summary):
+    """Iterate over archive ids given as arguments or read from stdin.
+
+    Lines read from stdin are either archive ids or JSON objects with an
+    "_id" key (e.g. the output of "astr query"). Malformed lines are counted
+    as failed items and skipped.
+
+    Args:
+        ids (List[str]): ids given on the command line, stdin is read if
+            empty or equal to ["-"]
+        summary (_Summary): summary of the command, to report malformed lines
+
+    Yields:
+        (str) archive ids
+    """
+    if ids and ids != ["-"]:
+        for id_ in ids:
+            yield id_
+        return
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        if not line.startswith("{"):
+            yield line
+            continue
+        try:
+            id_ = json.loads(line)["_id"]
+        except (ValueError, KeyError, TypeError) as e:
+            summary.failure(line, "malformed line ({!r})".format(e))
+            continue
+        yield id_
+
+
+def _write_json_line(obj):
+    sys.stdout.write(json.dumps(obj, sort_keys=True) + "\n")
+    sys.stdout.flush()
+
+
+def _parse_descriptors(values):
+    """Convert a list of "name=value" strings into a dictionary of descriptors."""
+    descriptors = {}
+    for value in values or []:
+        if "=" not in value:
+            raise argparse.ArgumentTypeError(
+                "descriptor must be given as name=value: {}".format(value))
+        key, _, value = value.partition("=")
+        descriptors[key] = value
+    return descriptors
+
+
+def _folder_size(folder):
+    size = 0
+    for root, _, files in os.walk(folder):
+        for name in files:
+            size += os.path.getsize(os.path.join(root, name))
+    return size
+
+
+def _make_client(args):
+    """Create the AstrClient shared by the threads of a command."""
+    from .client import AstrClient
+    from .scheduler import RequestScheduler
+    scheduler = None
+    if args.rate is not None or getattr(args, "jobs", None):
+        scheduler = RequestScheduler(rate=args.rate,
+                                     max_concurrency=getattr(args, "jobs", None))
+    return AstrClient(base_url=args.url, email=args.email, token=args.token,
+                      scheduler=scheduler)
+
+
+# - [ Commands ] -------------------------------------------------------------
+
+def _mongodb_query(args):
+    """Build the mongoDB query from the query arguments of a command."""
+    from .resources import Browser
+    if args.mongo is not None:
+        return json.loads(args.mongo)
+    date = args.date
+    if date is not None and len(date) == 1:
+        date = date[0]
+    return Browser.args_to_mongodb_query(
+        author=args.author, date=date, category=args.category,
+        descriptors=_parse_descriptors(args.descriptor) or None)
+
+
+def _query(args):
+    """Stream the archives matching the query as JSON lines."""
+    query = _mongodb_query(args)
+    client = _make_client(args)
+    summary = _Summary("query")
+    for json_archive in client.iter_post("archives", params=query):
+        _write_json_line(json_archive)
+        summary.success()
+    return summary
+
+
+def _download(args):
+    """Download archives in parallel."""
+    from .resources import Archive
+    from .exceptions import PathError
+    if not os.path.isdir(args.local_path):
+        raise PathError("{} is not a valid directory".format(args.local_path))
+    client = _make_client(args)
+    summary = _Summary("download")
+
+    def download(id_):
+        archive = Archive(date=None, category=None, descriptors={},
+                          id_=id_, astrclient=client)
+        archive.download(args.local_path, extract=args.extract)
+        if args.extract:
+            path = os.path.join(args.local_path, id_)
+            return path, _folder_size(path)
+        path = os.path.join(args.local_path, id_ + ".zip")
+        return path, os.path.getsize(path)
+
+    for id_, result, error in _run_parallel(download, _read_ids(args.ids, summary), args.jobs):
+        if error is not None:
+            summary.failure(id_, error)
+        else:
+            path, size = result
+            _write_json_line({"_id": id_, "path": path, "bytes": size})
+            summary.success(size)
+    return summary
+
+
+def _upload_folders(roots, recursive):
+    """Iterate over the folders to upload, i.e. containing at least one file."""
+    for root in roots:
+        if not recursive:
+            yield root
+            continue
+        for folder, _, files in os.walk(root):
+            if files:
+                yield folder
+
+
+def _upload(args):
+    """Upload folders in parallel, one archive per folder."""
+    from .resources import Archive
+    from .validation import DescriptorValidator
+    client = _make_client(args)
+    descriptors = _parse_descriptors(args.descriptor)
+    # All folders share the same metadata: check it once before any upload
+    DescriptorValidator(client).check_archives([
+        Archive(date=args.date, category=args.category, descriptors=descriptors,
+                astrclient=client)])
+    summary = _Summary("upload")
+
+    def upload(folder):
+        paths = sorted(os.path.join(folder, name) for name in os.listdir(folder)
+                       if os.path.isfile(os.path.join(folder, name)))
+        archive = Archive(date=args.date, category=args.category,
+                          descriptors=dict(descriptors), comments=args.comments,
+                          astrclient=client)
+        archive.upload(paths)
+        return archive.id_, sum(os.path.getsize(path) for path in paths)
+
+    folders = _upload_folders(args.folders, args.recursive)
+    for folder, result, error in _run_parallel(upload, folders, args.jobs):
+        if error is not None:
+            summary.failure(folder, error)
+        else:
+            id_, size = result
+            _write_json_line({"_id": id_, "path": folder, "bytes": size})
+            summary.success(size)
+    return summary
+
+
+def _delete(args):
+    """Delete archives in parallel."""
+    client = _make_client(args)
+    summary = _Summary("delete")
+
+    def delete(id_):
+        client.send_delete("archives/id/" + id_)
+
+    for id_, _, error in _run_parallel(delete, _read_ids(args.ids, summary), args.jobs):
+        if error is not None:
+            summary.failure(id_, error)
+        else:
+            _write_json_line({"_id": id_, "deleted": True})
+            summary.success()
+    return summary
+
+
+def _mirror(args):
+    """Incrementally mirror the archives matching the query."""
+    from .resources import Browser
+    browser = Browser(_make_client(args))
+    summary = _Summary("mirror")
+    result = browser.mirror(_mongodb_query(args), args.local_root, jobs=args.jobs,
+                            prune=not args.no_prune, extract=not args.zip,
+                            force_prune=args.force_prune)
+    for id_, error in result["failed"].items():
+        summary.failure(id_, error)
+    summary.succeeded = result["downloaded"]
+    _write_json_line({"downloaded": result["downloaded"],
+                      "unchanged": result["unchanged"],
+                      "updated": result["updated"],
+                      "pruned": result["pruned"],
+                      "kept": result["kept"],
+                      "failed": len(result["failed"])})
+    return summary
+
+
+def _export(args):
+    """Export the metadata of the archives matching the query to a file."""
+    from .resources import Browser
+    browser = Browser(_make_client(args))
+    summary = _Summary("export")
+    count = browser.export_archives(_mongodb_query(args), args.path, format=args.format,
+                                    compression=args.compression)
+    summary.succeeded = count
+    summary.bytes = os.path.getsize(args.path)
+    return summary
+
+
+# - [ Parser ] ---------------------------------------------------------------
+
+def _add_query_arguments(parser):
+    parser.add_argument("--author", help="archive author (e.g. 'John DOE')")
+    parser.add_argument("--date", nargs="+", metavar="DATE",
+                        help="archive date, or first and last dates of a range")
+    parser.add_argument("--category", help="archive category")
+    parser.add_argument("-d", "--descriptor", action="append", metavar="NAME=VALUE",
+                        help="descriptor value, can be repeated")
+    parser.add_argument("--mongo", metavar="JSON",
+                        help="raw mongoDB query, replaces the other filters")
+
+
+def _add_jobs_argument(parser):
+    parser.add_argument("-j", "--jobs", type=int, default=DEFAULT_JOBS,
+                        help="number of parallel transfers (default: {})".format(DEFAULT_JOBS))
+
+
+def _add_ids_argument(parser):
+    parser.add_argument("ids", nargs="*",
+                        help="archive ids, read from stdin (one id or JSON object "
+                             "per line) if not given or '-'")
+
+
+def get_parser():
+    """Build the argument parser of the astr command.
+
+    Returns:
+        (argparse.ArgumentParser) parser of the astr command
+    """
+    parser = argparse.ArgumentParser(
+        prog="astr", description="Command-line tool for ASTR servers.")
+    parser.add_argument("--url", help="ASTR base url (default: $LIBASTR_URL)")
+    parser.add_argument("--email", help="user email (default: $LIBASTR_EMAIL)")
+    parser.add_argument("--token", help="user token (default: $LIBASTR_TOKEN)")
+    parser.add_argument("--rate", type=float,
+                        help="maximum number of requests per second")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    query = subparsers.add_parser("query", help="print matching archives as JSON lines")
+    _add_query_arguments(query)
+    query.set_defaults(func=_query)
+
+    download = subparsers.add_parser("download", help="download archives")
+    download.add_argument("local_path", help="directory where archives are downloaded")
+    _add_ids_argument(download)
+    download.add_argument("-x", "--extract", action="store_true",
+                          help="extract the archives in <local_path>/<id>")
+    _add_jobs_argument(download)
+    download.set_defaults(func=_download)
+
+    upload = subparsers.add_parser("upload", help="upload folders, one archive per folder")
+    upload.add_argument("folders", nargs="+", help="folders to upload")
+    upload.add_argument("--category", required=True, help="archive category")
+    upload.add_argument("--date", required=True, help="archive date (YYYY-MM-DD)")
+    upload.add_argument("-d", "--descriptor", action="append", metavar="NAME=VALUE",
+                        help="descriptor value, can be repeated")
+    upload.add_argument("--comments", help="comments about the archives")
+    upload.add_argument("-r", "--recursive", action="store_true",
+                        help="upload every folder containing files under the given folders")
+    _add_jobs_argument(upload)
+    upload.set_defaults(func=_upload)
+
+    delete = subparsers.add_parser("delete", help="delete archives")
+    _add_ids_argument(delete)
+    _add_jobs_argument(delete)
+    delete.set_defaults(func=_delete)
+
+    mirror = subparsers.add_parser("mirror", help="incrementally mirror matching archives")
+    mirror.add_argument("local_root", help="directory containing the mirror")
+    _add_query_arguments(mirror)
+    mirror.add_argument("--zip", action="store_true",
+                        help="keep the archives as <local_root>/<id>.zip instead of extracting them")
+    mirror.add_argument("--no-prune", action="store_true",
+                        help="keep local archives which do not match the query anymore")
+    mirror.add_argument("--force-prune", action="store_true",
+                        help="prune even if most (or all) mirrored archives do not match "
+                             "the query anymore")
+    _add_jobs_argument(mirror)
+    mirror.set_defaults(func=_mirror)
+
+    export = subparsers.add_parser("export", help="export metadata of matching archives to a file")
+    export.add_argument("path", help="output file")
+    _add_query_arguments(export)
+    export.add_argument("--format", choices=["jsonl", "csv", "parquet"], default="jsonl",
+                        help="output format (default: jsonl)")
+    export.add_argument("--compression",
+                        help="gzip, bz2 or xz for jsonl and csv (default: from the "
+                             "file extension), parquet codec for parquet")
+    export.set_defaults(func=_export)
+    return parser
+
+
+def main(argv=None):
+    """Entry point of the astr command.
+
+    Args:
+        argv (List[str]): (optional) command-line arguments, sys.argv if None
+
+    Returns:
+        (int) exit code: 0 if every item succeeded, 1 otherwise
+    """
+    args = get_parser().parse_args(argv)
+    try:
+        summary = args.func(args)
+    except (Exception, KeyboardInterrupt) as e:
+        get_logger("astr").error("{}: {}".format(args.command, e))
+        return 1
+    summary.report()
+    return 1 if summary.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
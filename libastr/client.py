@@ -9,16 +9,20 @@ file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import urllib.parse
 import requests
+import json
 import os
 import base64
+from contextlib import contextmanager
 from .logger import get_logger
 from .exceptions import *
+from .scheduler import PRIORITY_INTERACTIVE, PRIORITY_BULK
 
 
 # - [ Client ] ---------------------------------------------------------------
 
 class AstrClient(object):
-    def __init__(self, base_url=None, email=None, token=None):
+    def __init__(self, base_url=None, email=None, token=None, scheduler=None,
+                 coalesce=False):
         """AstrClient object enable to send API requests to ASTR.
 
         Args:
@@ -26,8 +30,19 @@ class AstrClient(object):
             base_url: (optional) ASTR instance base url (e.g. http://10.0.160.147:8000)
             email: (optional) a user email
             token: (optional) a token of this user
+            scheduler: (optional) a RequestScheduler shared with other clients
+                to rate limit and prioritize the outgoing requests
+            coalesce: (optional) if True, identical idempotent requests sent
+                at the same time by several threads share one network call
         """
         self._logger = get_logger(self.__class__.__name__)
+        self.scheduler = scheduler
+        self._singleflight = None
+        if coalesce:
+            from .singleflight import SingleFlight
+            self._singleflight = SingleFlight()
+        self._session = None
+        self._session_pid = None
 
         if base_url is None:
             base_url = self._get_base_url_config()
@@ -51,6 +66,18 @@ class AstrClient(object):
             "Content-Type": "application/json"
         }
 
+    def __getstate__(self):
+        # Logger and connections are not picklable, they are rebuilt on demand
+        state = self.__dict__.copy()
+        del state["_logger"]
+        state["_session"] = None
+        state["_session_pid"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._logger = get_logger(self.__class__.__name__)
+
     # - [ Configuration ] ----------------------------------------------------
 
     def _get_base_url_config(self):
@@ -84,27 +111,83 @@ class AstrClient(object):
 
     # - [ Request ] ----------------------------------------------------------
 
-    def _request(self, request_type, url, params=None):
+    def _get_session(self):
+        """Get the HTTP session of the current process.
+
+        Pooled connections must not be shared between a parent process and
+        its forked children, so a new session is created in each process.
+
+        Returns:
+            (requests.Session) HTTP session of this process
+        """
+        pid = os.getpid()
+        if self._session is None or self._session_pid != pid:
+            session = requests.Session()
+            max_concurrency = self.scheduler.max_concurrency if self.scheduler else None
+            if max_concurrency is not None and max_concurrency > requests.adapters.DEFAULT_POOLSIZE:
+                # Keep one pooled connection per concurrent request
+                adapter = requests.adapters.HTTPAdapter(pool_maxsize=max_concurrency)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+            self._session = session
+            self._session_pid = pid
+        return self._session
+
+    @contextmanager
+    def _scheduled(self, priority):
+        """Wait for the scheduler (if any) to allow a request to start.
+
+        Args:
+            priority (int): priority class of the request
+        """
+        if self.scheduler is None:
+            yield
+        else:
+            with self.scheduler.slot(priority):
+                yield
+
+    def coalesce(self, key, func, *args, **kwargs):
+        """Call func, sharing the call with identical ones in flight if coalescing is enabled.
+
+        Used by the requests of this client, and by the objects built on top
+        of it to share a whole operation (e.g. Archive.download() shares the
+        download and the extraction of an archive).
+
+        Args:
+            key (tuple): identifier of the request
+            func (callable): function sending the request
+            args, kwargs: arguments given to func
+
+        Returns:
+            The result of func
+        """
+        if self._singleflight is None:
+            return func(*args, **kwargs)
+        return self._singleflight.do(key, func, *args, **kwargs)
+
+    def _request(self, request_type, url, params=None, priority=PRIORITY_INTERACTIVE):
         """GET, POST and DELETE url requests to ASTR.
 
         Args:
             request_type (unicode): GET, POST or DELETE
             url (unicode): request url
             params (dict): request parameters (body request)
+            priority (int): priority class used by the scheduler
 
         Returns:
             (dict) Json response as a dictionary
         """
-        if request_type == "GET":
-            response = requests.get(url, headers=self.headers, json=params)
-        elif request_type == "DELETE":
-            response = requests.delete(url, headers=self.headers, json=params)
-        elif request_type == "POST":
-            response = requests.post(url, headers=self.headers, json=params)
-        else:
+        if request_type not in ("GET", "DELETE", "POST"):
             msg = "request type not supported: {}".format(request_type)
             self._logger.error(msg)
             raise Exception(msg)
+        with self._scheduled(priority):
+            if request_type == "GET":
+                response = self._get_session().get(url, headers=self.headers, json=params)
+            elif request_type == "DELETE":
+                response = self._get_session().delete(url, headers=self.headers, json=params)
+            else:
+                response = self._get_session().post(url, headers=self.headers, json=params)
         try:
             response.raise_for_status()
         except HTTPError:
@@ -112,17 +195,18 @@ class AstrClient(object):
             self._logger.error(msg)
             msg = "ASTR error message -> {}".format(response._content)
             self._logger.error(msg)
-            if response.status_code == "401":
-                raise AuthenticationFailure(response)
+            if response.status_code == 401:
+                raise AuthenticationFailure(response=response)
             response.raise_for_status()
         return response.json()
 
-    def send_get(self, uri, params=None):
+    def send_get(self, uri, params=None, priority=PRIORITY_INTERACTIVE):
         """GET request to ASTR
 
         Args:
             uri (unicode): get request uri (e.g. archives/id/5b29162874f5a43fc26f1f34)
             params (dict): request parameters
+            priority (int): (optional) priority class used by the scheduler
 
         Returns:
             (dict) Json response as a dictionary
@@ -130,14 +214,21 @@ class AstrClient(object):
         uri = urllib.parse.quote(uri)
         url = "{}{}".format(self.url, uri)
         self._logger.debug("GET: {}, params: {}".format(url, params))
-        return self._request("GET", url, params=params)
+        key = ("GET", url, json.dumps(params, sort_keys=True))
+        return self.coalesce(key, self._request, "GET", url,
+                             params=params, priority=priority)
 
-    def send_post(self, uri, params=None):
+    def send_post(self, uri, params=None, priority=PRIORITY_INTERACTIVE,
+                  idempotent=False):
         """POST request to ASTR.
 
         Args:
             uri (unicode): post request uri (e.g. archives/add)
             params (dict): request parameters
+            priority (int): (optional) priority class used by the scheduler
+            idempotent (bool): (optional) True if the request does not modify
+                anything on the server (e.g. a query), so that identical
+                concurrent requests can be coalesced
 
         Returns:
             (dict) Json response as a dictionary
@@ -145,14 +236,61 @@ class AstrClient(object):
         uri = urllib.parse.quote(uri)
         url = "{}{}".format(self.url, uri)
         self._logger.debug("POST: {}, params: {}".format(url, params))
-        return self._request("POST", url, params=params)
+        if idempotent:
+            key = ("POST", url, json.dumps(params, sort_keys=True))
+            return self.coalesce(key, self._request, "POST", url,
+                                 params=params, priority=priority)
+        return self._request("POST", url, params=params, priority=priority)
+
+    def iter_post(self, uri, params=None, priority=PRIORITY_BULK):
+        """POST request to ASTR whose JSON array response is decoded as a stream.
+
+        Items are yielded while the response is being received, so that large
+        results (e.g. a query on the whole catalogue) are never held in
+        memory at once. The scheduler slot is released once the response
+        headers are received, so that the consumer can send other requests
+        while iterating, even with a scheduler limited to one request at once.
 
-    def send_delete(self, uri, params=None):
+        Args:
+            uri (unicode): post request uri (e.g. archives)
+            params (dict): request parameters
+            priority (int): (optional) priority class used by the scheduler
+
+        Yields:
+            (dict) items of the Json array
+
+        Raises:
+            APIError: if the response is not a Json array.
+        """
+        uri = urllib.parse.quote(uri)
+        url = "{}{}".format(self.url, uri)
+        self._logger.debug("POST (stream): {}, params: {}".format(url, params))
+        with self._scheduled(priority):
+            response = self._get_session().post(url, headers=self.headers, json=params,
+                                                stream=True)
+        try:
+            try:
+                response.raise_for_status()
+            except HTTPError:
+                msg = "The following request returned an error code {} -> {}".format(response.status_code, url)
+                self._logger.error(msg)
+                msg = "ASTR error message -> {}".format(response.content)
+                self._logger.error(msg)
+                if response.status_code == 401:
+                    raise AuthenticationFailure(response=response)
+                response.raise_for_status()
+            for item in _iter_json_array(response.iter_content(chunk_size=64 * 1024)):
+                yield item
+        finally:
+            response.close()
+
+    def send_delete(self, uri, params=None, priority=PRIORITY_INTERACTIVE):
         """DELETE request to ASTR.
 
         Args:
             uri (unicode): post request uri (e.g. archives/id/5b29162874f5a43fc26f1f34)
             params (dict): request parameters
+            priority (int): (optional) priority class used by the scheduler
 
         Returns:
             (dict) Json response as a dictionary
@@ -160,14 +298,15 @@ class AstrClient(object):
         uri = urllib.parse.quote(uri)
         url = "{}{}".format(self.url, uri)
         self._logger.debug("DELETE: {}, params: {}".format(url, params))
-        return self._request("DELETE", url, params=params)
+        return self._request("DELETE", url, params=params, priority=priority)
 
-    def download(self, uri, path):
+    def download(self, uri, path, priority=PRIORITY_BULK):
         """Download file from ASTR.
 
         Args:
             uri (unicode): post request uri (e.g. download/id/5b29162874f5a43fc26f1f34)
             path (str): location where the file will be saved
+            priority (int): (optional) priority class used by the scheduler
 
         Raises:
             AuthenticationFailure: If an error occured during authentication.
@@ -175,8 +314,20 @@ class AstrClient(object):
         """
         uri = urllib.parse.quote(uri)
         url = "{}{}".format(self.url, uri)
+        key = ("DOWNLOAD", url, os.path.abspath(path))
+        self.coalesce(key, self._download, url, path, priority)
+
+    def _download(self, url, path, priority):
+        """Download the file at url into path.
+
+        Args:
+            url (unicode): download url
+            path (str): location where the file will be saved
+            priority (int): priority class used by the scheduler
+        """
         self._logger.debug("Download: {}".format(url))
-        response = requests.get(url)
+        with self._scheduled(priority):
+            response = self._get_session().get(url)
 
         # Check the response
         try:
@@ -186,9 +337,9 @@ class AstrClient(object):
             self._logger.error(msg)
             msg = "ASTR error message -> {}".format(response._content)
             self._logger.error(msg)
-            if response.status_code == "401":
-                raise AuthenticationFailure(response)
-            if response.status_code == "404":
+            if response.status_code == 401:
+                raise AuthenticationFailure(response=response)
+            if response.status_code == 404:
                 raise ResourceNotFound(response)
             response.raise_for_status()
         if not response.ok:
@@ -198,13 +349,14 @@ class AstrClient(object):
         with open(path, "wb") as f:
             f.write(response.content)
 
-    def upload(self, uri, paths, zip_name):
+    def upload(self, uri, paths, zip_name, priority=PRIORITY_BULK):
         """Upload file(s) to ASTR.
 
         Args:
             uri (unicode): post request uri (e.g. upload)
             paths (List[str]): list of files paths to upload
             zip_name (str): name of the zip stored in ASTR
+            priority (int): (optional) priority class used by the scheduler
 
         Returns:
             (str) uploaded files
@@ -221,10 +373,11 @@ class AstrClient(object):
             for path in paths:
                 files.append(("files", open(path, "rb")))
                 filenames.append(path.split("/")[-1])
-            r = requests.post(url,
-                              data={"archiveId": zip_name, "files": filenames},
-                              files=files,
-                              auth=(self.email, self.token))
+            with self._scheduled(priority):
+                r = self._get_session().post(url,
+                                             data={"archiveId": zip_name, "files": filenames},
+                                             files=files,
+                                             auth=(self.email, self.token))
             try:
                 r.raise_for_status()
             except HTTPError:
@@ -232,16 +385,101 @@ class AstrClient(object):
                 self._logger.error(msg)
                 msg = "ASTR error message -> {}".format(r._content)
                 self._logger.error(msg)
-                if r.status_code == "401":
-                    raise AuthenticationFailure(r)
+                if r.status_code == 401:
+                    raise AuthenticationFailure(response=r)
                 r.raise_for_status()
         finally:
             for f in files:
                 f[1].close()
         return r.text
 
+    def send_bytes(self, uri, data, priority=PRIORITY_BULK):
+        """POST raw binary data to ASTR (e.g. a part of a chunked upload).
+
+        Args:
+            uri (unicode): post request uri (e.g. upload/sessions/<id>/parts/0)
+            data (bytes): request body
+            priority (int): (optional) priority class used by the scheduler
+
+        Returns:
+            (dict) Json response as a dictionary
+
+        Raises:
+            AuthenticationFailure: If authentication failed.
+        """
+        uri = urllib.parse.quote(uri)
+        url = "{}{}".format(self.url, uri)
+        self._logger.debug("POST bytes: {}, size: {}".format(url, len(data)))
+        headers = dict(self.headers)
+        headers["Content-Type"] = "application/octet-stream"
+        with self._scheduled(priority):
+            response = self._get_session().post(url, headers=headers, data=data)
+        try:
+            response.raise_for_status()
+        except HTTPError:
+            msg = "The following request returned an error code {} -> {}".format(response.status_code, url)
+            self._logger.error(msg)
+            msg = "ASTR error message -> {}".format(response._content)
+            self._logger.error(msg)
+            if response.status_code == 401:
+                raise AuthenticationFailure(response=response)
+            response.raise_for_status()
+        return response.json()
+
+    def upload_chunked(self, paths, zip_name, part_size=None, progress=None,
+                       replace=False):
+        """Upload file(s) to ASTR in fixed-size parts through a resumable session.
+
+        The files are zipped locally, then the zip is sent part by part, each
+        part being retried on connection errors, and the session is committed.
+        If the upload fails, the raised UploadError gives a resume token to
+        continue it later with resume_upload().
+
+        Args:
+            paths (List[str]): list of files paths to upload
+            zip_name (str): name of the zip stored in ASTR (the archive id)
+            part_size (int): (optional) size of the parts in bytes
+            progress (callable): (optional) called with the number of bytes
+                sent and the total size after each part
+            replace (bool): (optional) True to replace the zip of an existing
+                archive
+
+        Raises:
+            UploadError: if the upload failed, with a resume token.
+        """
+        from .upload import UploadSession
+        session = UploadSession.create(self, zip_name, paths, part_size=part_size,
+                                       replace=replace)
+        session.upload(progress=progress)
+
+    def resume_upload(self, token, progress=None):
+        """Resume a chunked upload which previously failed.
+
+        Args:
+            token (dict): resume token (UploadError.token)
+            progress (callable): (optional) same than upload_chunked()
+
+        Raises:
+            UploadError: if the upload failed again, with a resume token.
+        """
+        from .upload import UploadSession
+        UploadSession.from_token(self, token).upload(progress=progress)
+
     # - [ Utils ] ----------------------------------------------------------
 
+    def get_stats(self):
+        """Get the statistics of the request coalescing and of the scheduler.
+
+        Returns:
+            (dict) coalescing statistics (see SingleFlight.get_stats()) and
+              scheduler metrics (see RequestScheduler.get_metrics()), None
+              when the feature is not enabled
+        """
+        return {"coalescing": (self._singleflight.get_stats()
+                               if self._singleflight is not None else None),
+                "scheduler": (self.scheduler.get_metrics()
+                              if self.scheduler is not None else None)}
+
     def get_username(self):
         """Get the client username.
 
@@ -253,3 +491,59 @@ class AstrClient(object):
             return user["firstname"] + " " + user["lastname"]
         else:
             return "Error: user not found"
+
+
+# - [ Helpers ] --------------------------------------------------------------
+
+def _iter_json_array(chunks):
+    """Decode a Json array from chunks of bytes, yielding its items one by one.
+
+    Args:
+        chunks (iterable): bytes of the Json document
+
+    Yields:
+        items of the array
+    """
+    import codecs
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+    buf = ""
+    pos = 0
+    started = False
+    finished = False
+    while True:
+        # Skip whitespace and separators, then decode as many items as possible
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos == len(buf):
+                break
+            if not started:
+                if buf[pos] != "[":
+                    raise APIError("Expected a Json array, got: {}".format(buf[pos:pos + 100]))
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == "]":
+                return
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except ValueError as e:
+                if finished:
+                    raise APIError("Invalid Json array: {}".format(e)) from e
+                break
+            if not finished and (end == len(buf) or buf[end] not in " \t\r\n,]"):
+                # The item may continue in the next chunk (e.g. "12" of "12.5")
+                break
+            yield item
+            pos = end
+        if finished:
+            raise APIError("Unexpected end of the Json array")
+        buf = buf[pos:]
+        pos = 0
+        try:
+            buf += utf8.decode(next(chunks))
+        except StopIteration:
+            buf += utf8.decode(b"", final=True)
+            finished = True
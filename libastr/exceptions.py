@@ -39,6 +39,21 @@ class ArchiveError(Exception):
     pass
 
 
+class ValidationError(ArchiveError):
+    """Error raised when archives do not match their category before upload.
+
+    Attributes:
+        errors (dict): index of each invalid archive -> list of error messages
+    """
+
+    def __init__(self, errors):
+        self.errors = errors
+        messages = []
+        for index, archive_errors in sorted(errors.items()):
+            messages.append("archive #{}: {}".format(index, "; ".join(archive_errors)))
+        super(ValidationError, self).__init__("\n".join(messages))
+
+
 class PathError(Exception):
     """PathError Exception."""
     pass
@@ -48,3 +63,16 @@ class DownloadError(Exception):
     """Error raised when download encountered an issue."""
     pass
 
+
+class UploadError(Exception):
+    """Error raised when a chunked upload failed.
+
+    Attributes:
+        token (dict): JSON serializable resume token, to be given to
+            AstrClient.resume_upload() to continue the upload
+    """
+
+    def __init__(self, msg, token):
+        self.token = token
+        super(UploadError, self).__init__(msg)
+
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""libastr streaming export of archive metadata to JSONL, CSV or Parquet.
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+import json
+import os
+
+from .logger import get_logger
+from .records import FIELDS, descriptor_key, flatten_archive
+
+FORMATS = ("jsonl", "csv", "parquet")
+DEFAULT_PAGE_SIZE = 1000
+
+# Compression of the text formats, inferred from the file extension if not given
+_COMPRESSION_EXTENSIONS = {".gz": "gzip", ".bz2": "bz2", ".xz": "xz"}
+
+
+# - [ Helpers ] --------------------------------------------------------------
+
+def _open_text(path, compression):
+    """Open a text file for writing, compressed or not."""
+    if compression is None:
+        return open(path, "w", newline="", encoding="utf-8")
+    if compression == "gzip":
+        import gzip
+        return gzip.open(path, "wt", newline="", encoding="utf-8")
+    if compression == "bz2":
+        import bz2
+        return bz2.open(path, "wt", newline="", encoding="utf-8")
+    if compression == "xz":
+        import lzma
+        return lzma.open(path, "wt", newline="", encoding="utf-8")
+    raise ValueError("Unsupported compression: {}".format(compression))
+
+
+def _cell(value):
+    """Convert a record value to the text of a csv or parquet cell.
+
+    Strings are kept as they are and None stays empty, other values
+    (numbers, booleans, lists of a descriptor) are written as Json.
+    """
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value)
+
+
+def _pages(records, page_size):
+    """Group records in lists of at most page_size records."""
+    page = []
+    for record in records:
+        page.append(record)
+        if len(page) == page_size:
+            yield page
+            page = []
+    if page:
+        yield page
+
+
+# - [ Exporter ] -------------------------------------------------------------
+
+class ArchiveExporter(object):
+    """Stream the archives matching a query to a file, page by page.
+
+    Archives are decoded one by one from the API response and written as soon
+    as a page is complete, so memory usage does not depend on the number of
+    exported archives.
+    """
+
+    def __init__(self, browser):
+        """Initialize an ArchiveExporter.
+
+        Args:
+            browser (Browser): browser used to query archives and categories
+        """
+        self._logger = get_logger(self.__class__.__name__)
+        self._browser = browser
+
+    def _descriptor_columns(self, query):
+        """Get the descriptor columns of the export, from the archive categories.
+
+        Args:
+            query (dict): mongoDB query of the export
+
+        Returns:
+            (List[str]) sorted descriptor names
+        """
+        if isinstance(query.get("category"), str):
+            categories = [self._browser.get_archive_category_by_name(query["category"])]
+        else:
+            categories = self._browser.get_all_archive_categories()
+        names = set()
+        for category in categories:
+            for name in category.descriptors:
+                names.add(descriptor_key(name))
+        return sorted(names)
+
+    def _records(self, query):
+        for json_object in self._browser._astrclient.iter_post("archives", params=query):
+            yield flatten_archive(json_object)
+
+    def export(self, query, path, format="jsonl", compression=None, descriptors=None,
+               page_size=DEFAULT_PAGE_SIZE):
+        """Export the archives matching the query.
+
+        Args:
+            query (dict): mongoDB query (e.g. {category: "MY_CAT"}), {} for
+                all archives
+            path (str): output file. The export is written to path + ".tmp"
+                first, and renamed to path only if it succeeds
+            format (str): (optional) "jsonl", "csv" or "parquet"
+            compression (str): (optional) "gzip", "bz2" or "xz" for jsonl and
+                csv (inferred from the extension of path if not given),
+                codec name for parquet (e.g. "snappy", "zstd")
+            descriptors (List[str]): (optional) descriptor columns of csv and
+                parquet exports. Defaults to the descriptors of the queried
+                category, or of all categories.
+            page_size (int): (optional) number of archives written at once
+
+        Returns:
+            (int) number of exported archives
+        """
+        if format not in FORMATS:
+            raise ValueError("Unsupported format {!r}, expected one of {}".format(format, FORMATS))
+        if format != "jsonl" and descriptors is None:
+            descriptors = self._descriptor_columns(query)
+        if format != "parquet" and compression is None:
+            compression = _COMPRESSION_EXTENSIONS.get(os.path.splitext(path)[1])
+        records = self._records(query)
+        # Written aside, so that a failed export never leaves a truncated file at path
+        tmp_path = path + ".tmp"
+        try:
+            if format == "jsonl":
+                count = self._export_jsonl(records, tmp_path, compression, page_size)
+            elif format == "csv":
+                count = self._export_csv(records, tmp_path, compression,
+                                         list(FIELDS) + descriptors, page_size)
+            else:
+                count = self._export_parquet(records, tmp_path, compression,
+                                             list(FIELDS) + descriptors, page_size)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        os.replace(tmp_path, path)
+        self._logger.info("{} archive(s) exported to {}".format(count, path))
+        return count
+
+    def _export_jsonl(self, records, path, compression, page_size):
+        count = 0
+        with _open_text(path, compression) as f:
+            for page in _pages(records, page_size):
+                f.write("".join(json.dumps(record) + "\n" for record in page))
+                count += len(page)
+        return count
+
+    def _export_csv(self, records, path, compression, columns, page_size):
+        import csv
+        count = 0
+        with _open_text(path, compression) as f:
+            writer = csv.DictWriter(f, fieldnames=columns, extrasaction="ignore")
+            writer.writeheader()
+            for page in _pages(records, page_size):
+                writer.writerows({column: _cell(record.get(column)) for column in columns}
+                                 for record in page)
+                count += len(page)
+        return count
+
+    def _export_parquet(self, records, path, compression, columns, page_size):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as e:
+            raise ImportError("Parquet export requires pyarrow, install it with "
+                              "'pip install libastr[parquet]'") from e
+        # Descriptor values are not typed by ASTR, every column is a string
+        schema = pyarrow.schema([(column, pyarrow.string()) for column in columns])
+        count = 0
+        with pyarrow.parquet.ParquetWriter(path, schema,
+                                           compression=compression or "snappy") as writer:
+            for page in _pages(records, page_size):
+                arrays = [pyarrow.array([_cell(record.get(column)) for record in page],
+                                        type=pyarrow.string())
+                          for column in columns]
+                writer.write_batch(pyarrow.RecordBatch.from_arrays(arrays, schema=schema))
+                count += len(page)
+        return count
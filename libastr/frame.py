@@ -0,0 +1,386 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""libastr columnar container for large query results.
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+try:
+    import numpy as np
+except ImportError as e:
+    raise ImportError("ArchiveFrame requires numpy, install it with "
+                      "'pip install libastr[frame]'") from e
+
+from .records import FIELDS, descriptor_name, flatten_archive
+
+
+# - [ Helpers ] --------------------------------------------------------------
+
+def _hashable(value):
+    """Get a hashable equivalent of a value: lists become tuples, dicts sorted tuples."""
+    if isinstance(value, list):
+        return tuple(_hashable(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, _hashable(item)) for key, item in value.items()))
+    return value
+
+
+def _factorize(values):
+    """Encode values as integer codes.
+
+    Args:
+        values (np.ndarray): column to encode
+
+    Returns:
+        (tuple) codes (np.ndarray of int) and dict of unique value -> code,
+          such that codes[i] == uniques[_hashable(values[i])]
+    """
+    uniques = {}
+    codes = np.empty(len(values), dtype=np.intp)
+    for i, value in enumerate(values):
+        try:
+            codes[i] = uniques.setdefault(value, len(uniques))
+        except TypeError:
+            # Unhashable descriptor value, e.g. a list
+            codes[i] = uniques.setdefault(_hashable(value), len(uniques))
+    return codes, uniques
+
+
+def _combine(encoded):
+    """Combine the codes of several columns into a single code per row.
+
+    Args:
+        encoded (List[tuple]): codes and list of unique values of each column,
+            all columns having the same length
+
+    Returns:
+        (tuple) codes (np.ndarray of int) and list of unique value tuples
+    """
+    codes, uniques = encoded[0]
+    keys = [(value,) for value in uniques]
+    for other_codes, other_uniques in encoded[1:]:
+        # Combine two columns at a time so that flat codes never overflow
+        flat = codes * max(len(other_uniques), 1) + other_codes
+        combined, codes = np.unique(flat, return_inverse=True)
+        codes = codes.reshape(-1)
+        keys = [keys[key // max(len(other_uniques), 1)]
+                + (other_uniques[key % max(len(other_uniques), 1)],) for key in combined]
+    return codes, keys
+
+
+# - [ Archive Frame ] --------------------------------------------------------
+
+class ArchiveFrame(object):
+    """Archives fields and descriptors stored in columns.
+
+    Each column is a NumPy object array. Descriptors missing in an archive
+    are None. Columns can be compared directly with NumPy to build boolean
+    masks, e.g. frame[frame["my_desc"] == "MY VALUE"]. Columns are factorized
+    into integer codes on first use by isin(), where() and groupby_count(),
+    and must not be modified in place.
+    """
+
+    def __init__(self, columns, descriptor_names, astrclient=None):
+        """Initialize an ArchiveFrame from columns.
+
+        Users should rather use ArchiveFrame.from_json() or
+        Browser.get_archive_frame_by_args().
+
+        Args:
+            columns (dict): column name -> np.ndarray, all of the same length
+            descriptor_names (List[str]): names of the columns holding
+                descriptors
+            astrclient (AstrClient): (optional) client given to the archives
+                created by to_archives()
+        """
+        lengths = set(len(column) for column in columns.values())
+        if len(lengths) > 1:
+            raise ValueError("Columns must have the same length: {}".format(sorted(lengths)))
+        self._columns = columns
+        self.descriptor_names = list(descriptor_names)
+        self._astrclient = astrclient
+        # column name -> (codes, dict of unique value -> code), built on first use
+        self._encoded = {}
+
+    @classmethod
+    def from_json(cls, json_list, astrclient=None):
+        """Build an ArchiveFrame directly from the archives returned by the ASTR API.
+
+        Args:
+            json_list: json array returned by ASTR API
+            astrclient (AstrClient): (optional) client given to the archives
+                created by to_archives()
+
+        Returns:
+            (ArchiveFrame) frame containing one row per archive
+        """
+        size = len(json_list)
+        columns = {field: np.empty(size, dtype=object) for field in FIELDS}
+        for i, json_object in enumerate(json_list):
+            for name, value in flatten_archive(json_object).items():
+                column = columns.get(name)
+                if column is None:
+                    column = columns[name] = np.empty(size, dtype=object)
+                column[i] = value
+        descriptor_names = [name for name in columns if name not in FIELDS]
+        return cls(columns, descriptor_names, astrclient=astrclient)
+
+    def __len__(self):
+        if not self._columns:
+            return 0
+        return len(next(iter(self._columns.values())))
+
+    def __repr__(self):
+        return "<{}.{}, rows={}, columns={}>".format(__name__,
+                                                     self.__class__.__name__,
+                                                     len(self),
+                                                     self.columns)
+
+    @property
+    def columns(self):
+        """(List[str]) names of all the columns."""
+        return list(self._columns)
+
+    def __getitem__(self, key):
+        """Get a column by name, or the rows selected by a mask, a slice or indices.
+
+        Args:
+            key: column name, row index, boolean mask, slice or array of row
+                indices
+
+        Returns:
+            (np.ndarray) the column if key is a name, (ArchiveFrame) otherwise
+              (a single row index gives a frame of one row)
+        """
+        if isinstance(key, str):
+            try:
+                return self._columns[key]
+            except KeyError:
+                raise KeyError("No column named {!r}".format(key))
+        return self.take(key)
+
+    def take(self, rows):
+        """Select rows.
+
+        Args:
+            rows: row index, boolean mask, slice or array of row indices
+
+        Returns:
+            (ArchiveFrame) new frame containing only the selected rows
+        """
+        if isinstance(rows, (bool, np.bool_)):
+            raise TypeError("Rows must be selected by index, mask or slice, not {!r}".format(rows))
+        if isinstance(rows, (int, np.integer)):
+            if not -len(self) <= rows < len(self):
+                raise IndexError("Row {} out of range for {} rows".format(rows, len(self)))
+            rows = [rows]
+        frame = ArchiveFrame({name: column[rows] for name, column in self._columns.items()},
+                             self.descriptor_names, astrclient=self._astrclient)
+        # Selected rows keep their codes, so filters can be chained without re-encoding
+        for name, (codes, uniques) in self._encoded.items():
+            frame._encoded[name] = (codes[rows], uniques)
+        return frame
+
+    def _encode(self, name):
+        """Get the integer codes of a column, factorizing it on first use.
+
+        Args:
+            name (str): column name
+
+        Returns:
+            (tuple) codes (np.ndarray of int) and dict of unique value -> code.
+              A code may have no row in a frame obtained by selecting rows.
+        """
+        encoded = self._encoded.get(name)
+        if encoded is None:
+            encoded = self._encoded[name] = _factorize(self[name])
+        return encoded
+
+    # - [ Filtering ] --------------------------------------------------------
+
+    def isin(self, name, values):
+        """Build the mask of the rows whose column value is one of the given values.
+
+        Args:
+            name (str): column name
+            values (iterable): accepted values
+
+        Returns:
+            (np.ndarray) boolean mask
+        """
+        codes, uniques = self._encode(name)
+        accepted = []
+        for value in values:
+            code = uniques.get(_hashable(value))
+            if code is not None:
+                accepted.append(code)
+        if len(accepted) == 1:
+            return codes == accepted[0]
+        return np.isin(codes, accepted)
+
+    def where(self, conditions=None, **kwargs):
+        """Select the rows matching all the conditions.
+
+        Args:
+            conditions (dict): (optional) column name -> accepted value, or
+                list/tuple/set of accepted values
+            kwargs: same as conditions, for names which are valid identifiers
+
+        Returns:
+            (ArchiveFrame) new frame containing only the matching rows
+        """
+        conditions = dict(conditions or {}, **kwargs)
+        mask = np.ones(len(self), dtype=bool)
+        for name, value in conditions.items():
+            if isinstance(value, (list, tuple, set, frozenset)):
+                mask &= self.isin(name, value)
+            else:
+                mask &= self.isin(name, [value])
+        return self.take(mask)
+
+    # - [ Aggregation ] ------------------------------------------------------
+
+    def value_counts(self, name):
+        """Count the rows for each value of a column.
+
+        Args:
+            name (str): column name
+
+        Returns:
+            (dict) value -> number of rows, by decreasing count
+        """
+        return {key[0]: count for key, count in self.groupby_count(name).items()}
+
+    def groupby_count(self, *names):
+        """Count the rows for each combination of values of the given columns.
+
+        Args:
+            names (str): column names (e.g. "category", "my_desc")
+
+        Returns:
+            (dict) tuple of values -> number of rows, by decreasing count
+              (e.g. {("MY_CAT", "MY VALUE"): 1250, ("MY_CAT", None): 3}).
+              List values are returned as tuples.
+        """
+        if not names:
+            raise ValueError("At least one column name is required")
+        encoded = []
+        for name in names:
+            codes, uniques = self._encode(name)
+            encoded.append((codes, list(uniques)))
+        codes, keys = _combine(encoded)
+        counts = np.bincount(codes, minlength=len(keys))
+        order = np.argsort(-counts, kind="stable")
+        return {keys[i]: int(counts[i]) for i in order if counts[i]}
+
+    # - [ Join ] -------------------------------------------------------------
+
+    def join(self, other, on, suffix="_right"):
+        """Inner join with another frame on the values of one or several columns.
+
+        Args:
+            other (ArchiveFrame): frame to join with
+            on (str or List[str]): name(s) of the columns to join on
+                (e.g. a descriptor "serial_number")
+            suffix (str): (optional) suffix added to the columns of other
+                whose name is already used in this frame
+
+        Returns:
+            (ArchiveFrame) one row per pair of matching rows. Columns of this
+              frame are kept as is, followed by the other columns of other,
+              whose descriptors stay descriptors (with the suffix if renamed).
+              Rows with a missing value in one of the on columns are dropped.
+        """
+        if isinstance(on, str):
+            on = [on]
+        nb_left = len(self)
+        encoded = []
+        missing = np.zeros(nb_left + len(other), dtype=bool)
+        for name in on:
+            codes, uniques = _factorize(np.concatenate([self[name], other[name]]))
+            # Rows with a missing (None) key never match
+            if None in uniques:
+                missing |= codes == uniques[None]
+            encoded.append((codes, list(uniques)))
+        codes, _ = _combine(encoded)
+        codes[missing] = -1
+        left_codes, right_codes = codes[:nb_left], codes[nb_left:]
+
+        # For each left row, find the range of matching rows in the sorted right codes
+        order = np.argsort(right_codes, kind="stable")
+        sorted_codes = right_codes[order]
+        lower = np.searchsorted(sorted_codes, left_codes, side="left")
+        upper = np.searchsorted(sorted_codes, left_codes, side="right")
+        counts = upper - lower
+        counts[left_codes == -1] = 0
+        left_rows = np.repeat(np.arange(nb_left), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        right_rows = order[np.repeat(lower, counts) + offsets]
+
+        columns = {name: column[left_rows] for name, column in self._columns.items()}
+        descriptor_names = list(self.descriptor_names)
+        other_descriptors = set(other.descriptor_names)
+        for name, column in other._columns.items():
+            if name in on:
+                continue
+            is_descriptor = name in other_descriptors
+            if name in columns:
+                name += suffix
+            columns[name] = column[right_rows]
+            if is_descriptor:
+                descriptor_names.append(name)
+        return ArchiveFrame(columns, descriptor_names, astrclient=self._astrclient)
+
+    # - [ Export ] -----------------------------------------------------------
+
+    def to_dict(self):
+        """Get the columns of this frame.
+
+        Returns:
+            (dict) column name -> np.ndarray
+        """
+        return dict(self._columns)
+
+    def to_pandas(self):
+        """Export this frame to a pandas DataFrame (pandas must be installed).
+
+        Returns:
+            (pandas.DataFrame) one column per archive field and descriptor
+        """
+        import pandas
+        return pandas.DataFrame(self._columns, columns=self.columns)
+
+    def to_arrow(self):
+        """Export this frame to an Arrow table (pyarrow must be installed).
+
+        Returns:
+            (pyarrow.Table) one column per archive field and descriptor
+        """
+        import pyarrow
+        return pyarrow.table({name: pyarrow.array(column.tolist())
+                              for name, column in self._columns.items()})
+
+    def to_archives(self):
+        """Create an Archive object for each row.
+
+        Returns:
+            (List[Archive]) archives of this frame
+        """
+        from .resources import Archive
+        archives = []
+        for i in range(len(self)):
+            descriptors = {}
+            for name in self.descriptor_names:
+                value = self._columns[name][i]
+                if value is not None:
+                    descriptors[descriptor_name(name)] = value
+            archives.append(Archive(id_=self._columns["_id"][i],
+                                    author=self._columns["author"][i],
+                                    date=self._columns["date"][i],
+                                    category=self._columns["category"][i],
+                                    comments=self._columns["comments"][i],
+                                    descriptors=descriptors,
+                                    astrclient=self._astrclient))
+        return archives
@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""libastr incremental mirror of the archives matching a query.
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+from .logger import get_logger
+from .exceptions import *
+
+MANIFEST_NAME = ".astr-mirror.json"
+STAGING_NAME = ".astr-mirror-staging"
+MANIFEST_SAVE_INTERVAL = 5.0
+
+# Pruning more than this fraction of the mirror requires force_prune, e.g. when
+# a mistyped or failing query returns no archive, from this number of archives
+MAX_PRUNE_RATIO = 0.5
+MIN_PRUNE_GUARD = 10
+
+# Archive fields which can change without changing the zip (see Archive.update())
+METADATA_FIELDS = ("author", "category", "comments", "date", "descriptors")
+
+
+# - [ Helpers ] --------------------------------------------------------------
+
+def _hash(obj):
+    return hashlib.sha256(json.dumps(obj, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _zip_fingerprint(json_object):
+    """Hash the fields of an archive record which identify its zip.
+
+    The metadata fields are left out, the others (the id, and the
+    modification date set by the server when the zip is replaced) change
+    the fingerprint.
+    """
+    return _hash({key: value for key, value in json_object.items()
+                  if key not in METADATA_FIELDS})
+
+
+def _metadata_fingerprint(json_object):
+    """Hash the metadata fields of an archive record."""
+    return _hash({key: json_object.get(key) for key in METADATA_FIELDS})
+
+
+def _remove(path):
+    """Remove a file or a directory tree, if it exists."""
+    import shutil
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+# - [ Mirror ] ---------------------------------------------------------------
+
+class Mirror(object):
+    """Keep a local directory in sync with the archives matching a query.
+
+    A manifest stored in the local directory records the fingerprints of each
+    mirrored archive, so that only new archives and archives whose zip was
+    replaced are downloaded. A change of metadata only updates the manifest.
+    Archives are downloaded in a staging directory then moved in place, and
+    the manifest is only updated once an archive is complete, so an
+    interrupted mirror can safely be restarted.
+    """
+
+    def __init__(self, browser, query, local_root, extract=True):
+        """Initialize a Mirror.
+
+        Args:
+            browser (Browser): browser used to query and download archives
+            query (dict): mongoDB query selecting the archives to mirror
+            local_root (str): local directory containing the mirror
+            extract (bool): (optional) if True, archives are extracted in
+                <local_root>/<id>, otherwise kept as <local_root>/<id>.zip
+        """
+        self._logger = get_logger(self.__class__.__name__)
+        self._browser = browser
+        self.query = query
+        self.local_root = local_root
+        self.extract = extract
+        self._manifest_path = os.path.join(local_root, MANIFEST_NAME)
+        self._staging = os.path.join(local_root, STAGING_NAME)
+        self._lock = threading.Lock()
+        self._manifest = {}
+        self._last_save = 0.0
+
+    # - [ Manifest ] ---------------------------------------------------------
+
+    def _load_manifest(self):
+        if os.path.isfile(self._manifest_path):
+            with open(self._manifest_path, "r") as f:
+                self._manifest = json.load(f)["archives"]
+        else:
+            self._manifest = {}
+
+    def _save_manifest(self, force=False):
+        """Atomically write the manifest. Lock must be held.
+
+        Args:
+            force (bool): write even if the last save is recent
+        """
+        now = time.monotonic()
+        if not force and now - self._last_save < MANIFEST_SAVE_INTERVAL:
+            return
+        tmp_path = self._manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"query": self.query, "archives": self._manifest}, f)
+        os.replace(tmp_path, self._manifest_path)
+        self._last_save = now
+
+    def _target(self, id_):
+        """Get the path of a mirrored archive, relative to the local root."""
+        return id_ if self.extract else id_ + ".zip"
+
+    def _is_up_to_date(self, json_object):
+        """Check whether the local copy of an archive has the current zip."""
+        entry = self._manifest.get(json_object["_id"])
+        return (entry is not None
+                and entry["fingerprint"] == _zip_fingerprint(json_object)
+                and entry["path"] == self._target(json_object["_id"])
+                and os.path.exists(os.path.join(self.local_root, entry["path"])))
+
+    def _update_metadata(self, json_objects):
+        """Record the current metadata of up-to-date archives.
+
+        Returns:
+            (int) number of archives whose metadata changed
+        """
+        updated = 0
+        with self._lock:
+            for json_object in json_objects:
+                entry = self._manifest[json_object["_id"]]
+                metadata = _metadata_fingerprint(json_object)
+                if entry.get("metadata") != metadata:
+                    entry["metadata"] = metadata
+                    updated += 1
+        return updated
+
+    # - [ Sync ] -------------------------------------------------------------
+
+    def _fetch(self, json_object):
+        """Download an archive in the staging directory and move it in place."""
+        archive = self._browser._json_to_archive(json_object)
+        staging = os.path.join(self._staging, archive.id_)
+        _remove(staging)
+        os.makedirs(staging)
+        archive.download(staging, extract=self.extract)
+        target = self._target(archive.id_)
+        path = os.path.join(self.local_root, target)
+        # Move the previous version aside first, os.replace cannot overwrite a directory
+        old = os.path.join(self._staging, archive.id_ + ".old")
+        if os.path.exists(path):
+            os.replace(path, old)
+        os.replace(os.path.join(staging, target), path)
+        _remove(old)
+        _remove(staging)
+        with self._lock:
+            previous = self._manifest.get(archive.id_)
+            if previous is not None and previous["path"] != target:
+                # Mirrored before with another extract mode
+                _remove(os.path.join(self.local_root, previous["path"]))
+            self._manifest[archive.id_] = {"fingerprint": _zip_fingerprint(json_object),
+                                           "metadata": _metadata_fingerprint(json_object),
+                                           "path": target}
+            self._save_manifest()
+
+    def _prune(self, ids, force=False):
+        """Remove the mirrored archives which are not in ids anymore.
+
+        Args:
+            ids (set): ids of the archives matching the query
+            force (bool): remove them even if they are more than
+                MAX_PRUNE_RATIO of the mirror (and at least MIN_PRUNE_GUARD)
+
+        Returns:
+            (tuple) number of pruned archives, and of archives which should
+              have been pruned but were kept
+        """
+        with self._lock:
+            stale = [id_ for id_ in self._manifest if id_ not in ids]
+            if (not force and len(stale) >= MIN_PRUNE_GUARD
+                    and len(stale) > MAX_PRUNE_RATIO * len(self._manifest)):
+                self._logger.warning("Not pruning {} out of {} mirrored archives, the query "
+                                     "returned {} archive(s). Use force_prune to prune them."
+                                     .format(len(stale), len(self._manifest), len(ids)))
+                self._save_manifest(force=True)
+                return 0, len(stale)
+            for id_ in stale:
+                self._logger.info("Pruning archive {}".format(id_))
+                _remove(os.path.join(self.local_root, self._manifest[id_]["path"]))
+                del self._manifest[id_]
+            self._save_manifest(force=True)
+        return len(stale), 0
+
+    def run(self, jobs=4, prune=True, force_prune=False):
+        """Synchronize the local directory with the archives matching the query.
+
+        Args:
+            jobs (int): (optional) number of parallel downloads
+            prune (bool): (optional) if True, mirrored archives which do not
+                match the query anymore are removed
+            force_prune (bool): (optional) if True, prune even if more than
+                MAX_PRUNE_RATIO of the mirrored archives (e.g. all of them)
+                do not match the query anymore. Not needed to prune less
+                than MIN_PRUNE_GUARD archives.
+
+        Returns:
+            (dict) number of "downloaded", "unchanged" and "pruned" archives,
+              "updated": number of unchanged archives whose metadata changed,
+              "kept": number of archives not pruned for lack of force_prune,
+              and "failed": archive id -> error for the failed downloads
+        """
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+        if not os.path.isdir(self.local_root):
+            raise PathError("{} is not a valid directory".format(self.local_root))
+        self._load_manifest()
+        _remove(self._staging)
+        os.makedirs(self._staging)
+
+        json_list = self._browser._astrclient.send_post("archives", params=self.query,
+                                                         idempotent=True)
+        to_fetch = []
+        up_to_date = []
+        for json_object in json_list:
+            if self._is_up_to_date(json_object):
+                up_to_date.append(json_object)
+            else:
+                to_fetch.append(json_object)
+        updated = self._update_metadata(up_to_date)
+        self._logger.info("{} archive(s) to download out of {}".format(len(to_fetch), len(json_list)))
+
+        failed = {}
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = {executor.submit(self._fetch, json_object): json_object["_id"]
+                       for json_object in to_fetch}
+            for future in as_completed(futures):
+                error = future.exception()
+                if error is not None:
+                    self._logger.error("Cannot mirror archive {}: {}".format(futures[future], error))
+                    failed[futures[future]] = error
+
+        pruned = kept = 0
+        if prune:
+            pruned, kept = self._prune(set(json_object["_id"] for json_object in json_list),
+                                       force=force_prune)
+        else:
+            with self._lock:
+                self._save_manifest(force=True)
+        _remove(self._staging)
+        return {"downloaded": len(to_fetch) - len(failed),
+                "unchanged": len(up_to_date),
+                "updated": updated,
+                "pruned": pruned,
+                "kept": kept,
+                "failed": failed}
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""libastr flat records of the archives returned by the ASTR API.
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+# Archive fields of a record, with the key used by the ASTR API
+FIELDS = ("_id", "author", "date", "category", "comments")
+
+# Prefix of descriptor keys whose name collides with an archive field
+DESCRIPTOR_PREFIX = "descriptors."
+
+
+def descriptor_key(name):
+    """Get the record key of a descriptor.
+
+    Args:
+        name (str): descriptor name
+
+    Returns:
+        (str) name, prefixed by DESCRIPTOR_PREFIX if it is an archive field
+    """
+    return DESCRIPTOR_PREFIX + name if name in FIELDS else name
+
+
+def descriptor_name(key):
+    """Get the descriptor name of a record key, inverse of descriptor_key()."""
+    if key.startswith(DESCRIPTOR_PREFIX) and key[len(DESCRIPTOR_PREFIX):] in FIELDS:
+        return key[len(DESCRIPTOR_PREFIX):]
+    return key
+
+
+def flatten_archive(json_object):
+    """Flatten an archive returned by the API into a single-level record.
+
+    Args:
+        json_object: json object returned by ASTR API
+
+    Returns:
+        (dict) archive fields and one key per descriptor
+          (e.g. {"_id": "5b29...", "author": "John DOE", ..., "my_desc": "MY VALUE"})
+    """
+    record = {field: json_object.get(field) for field in FIELDS}
+    for descriptor in json_object.get("descriptors", []):
+        record[descriptor_key(descriptor["name"])] = descriptor["value"]
+    return record
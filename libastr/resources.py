@@ -9,8 +9,6 @@ file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import json
 import os.path
-import zipfile
-import shutil
 
 from libastr.client import AstrClient
 from .logger import get_logger
@@ -115,7 +113,8 @@ class Browser(object):
             (List[Archive]) list of archives
 
         """
-        return self._json_to_list_of_archives(self._astrclient.send_post("archives", params=query))
+        return self._json_to_list_of_archives(
+            self._astrclient.send_post("archives", params=query, idempotent=True))
 
     def get_archives_by_args(self, author=None, date=None, category=None, descriptors=None):
         """Get the archives that match with the arguments.
@@ -131,6 +130,52 @@ class Browser(object):
         Returns:
             (List[Archive]) list of archives
 
+        """
+        return self.get_archives_by_mongodb_query(
+            self.args_to_mongodb_query(author, date, category, descriptors))
+
+    def get_archive_frame_by_mongodb_query(self, query):
+        """Get the archives that match with the mongoDB query as an ArchiveFrame.
+
+        Columns are built directly from the API response, without creating
+        an Archive object per row, which is much faster for large results.
+        Requires numpy.
+
+        Args:
+            query: mongoDB query (e.g. {category: "MY_CAT", author: "John DOE"})
+
+        Returns:
+            (ArchiveFrame) archives in columns
+
+        """
+        from .frame import ArchiveFrame
+        return ArchiveFrame.from_json(
+            self._astrclient.send_post("archives", params=query, idempotent=True),
+            astrclient=self._astrclient)
+
+    def get_archive_frame_by_args(self, author=None, date=None, category=None, descriptors=None):
+        """Get the archives that match with the arguments as an ArchiveFrame.
+
+        Args:
+            Same than Browser.get_archives_by_args()
+
+        Returns:
+            (ArchiveFrame) archives in columns
+
+        """
+        return self.get_archive_frame_by_mongodb_query(
+            self.args_to_mongodb_query(author, date, category, descriptors))
+
+    @staticmethod
+    def args_to_mongodb_query(author=None, date=None, category=None, descriptors=None):
+        """Build the mongoDB query matching with the arguments.
+
+        Args:
+            Same than Browser.get_archives_by_args()
+
+        Returns:
+            (dict) mongoDB query
+
         """
         query = {}
         if author is not None:
@@ -151,7 +196,7 @@ class Browser(object):
                     }
                 })
             query["$and"] = descriptors_list
-        return self.get_archives_by_mongodb_query(query)
+        return query
 
     # -----------------------------------------
     # Methods for archive categories
@@ -235,6 +280,166 @@ class Browser(object):
         """
         return self._json_to_archive_category(self._astrclient.send_get("categories/name/" + name))
 
+    # -----------------------------------------
+    # Methods for archive processing
+    # -----------------------------------------
+
+    def map_archives(self, func, archives, processes=None, local_path=None,
+                     ordered=False):
+        """Download archives and process them in a pool of processes.
+
+        Each archive is downloaded and extracted by a worker process, which
+        then calls func(archive, archive_folder). Results are yielded as soon
+        as they are available.
+
+        Each worker process receives one copy of the AstrClient of this
+        browser, used for all its downloads. A scheduler cannot be shared
+        between processes: each worker has its own copy of the scheduler,
+        so the pool as a whole may send up to `processes` times the rate
+        and concurrency limits of the scheduler.
+
+        Args:
+            func (callable): picklable function (e.g. defined at module level)
+                called with the archive and the folder containing its
+                extracted files
+            archives (List[Archive]): archives to download and process
+            processes (int): (optional) number of worker processes.
+                Defaults to the number of CPUs.
+            local_path (str): (optional) directory where archives are
+                extracted and kept. If not given, each archive is extracted
+                in a temporary directory removed once func returns.
+            ordered (bool): (optional) if True, results are yielded in the
+                order of the archives instead of as soon as they are ready.
+
+        Yields:
+            (tuple) the archive and the value returned by func
+
+        Raises:
+            PathError: if the given local path is not valid.
+            Other exceptions: raised by the download or by func in a worker.
+        """
+        if local_path is not None and not os.path.isdir(local_path):
+            raise PathError("{} is not a valid directory".format(local_path))
+        import copy
+        import multiprocessing
+        pending = {}
+
+        def tasks():
+            for index, archive in enumerate(archives):
+                pending[index] = archive
+                # The client is sent once per worker, not with every archive
+                detached = copy.copy(archive)
+                detached._astrclient = None
+                yield func, index, detached, local_path
+
+        with multiprocessing.Pool(processes, initializer=_init_worker,
+                                  initargs=(self._astrclient,)) as pool:
+            if ordered:
+                results = pool.imap(_download_and_process, tasks())
+            else:
+                results = pool.imap_unordered(_download_and_process, tasks())
+            for index, result in results:
+                yield pending.pop(index), result
+
+    def mirror(self, query, local_root, jobs=4, prune=True, extract=True,
+               force_prune=False):
+        """Keep a local copy of the archives matching a query.
+
+        Only new archives and archives whose zip was replaced since the last
+        mirror are downloaded, a change of metadata only updates the manifest. A manifest is kept in the
+        local directory, and an interrupted mirror can safely be restarted.
+
+        Args:
+            query: mongoDB query (e.g. {category: "MY_CAT"}), see also
+                Browser.args_to_mongodb_query()
+            local_root (str): local directory containing the mirror
+            jobs (int): (optional) number of parallel downloads
+            prune (bool): (optional) if True, local archives which do not
+                match the query anymore are removed
+            extract (bool): (optional) if True, archives are extracted in
+                <local_root>/<id>, otherwise kept as <local_root>/<id>.zip
+            force_prune (bool): (optional) if True, prune even if more than
+                half of the mirrored archives (e.g. all of them, when the
+                query returns nothing) do not match the query anymore. Not
+                needed to prune less than 10 archives.
+
+        Returns:
+            (dict) number of "downloaded", "unchanged" and "pruned" archives,
+              "updated": number of unchanged archives whose metadata changed,
+              "kept": number of archives not pruned for lack of force_prune,
+              and "failed": archive id -> error for the failed downloads
+
+        Raises:
+            PathError: if the given local root is not a directory.
+        """
+        from .mirror import Mirror
+        return Mirror(self, query, local_root, extract=extract).run(jobs=jobs, prune=prune,
+                                                                   force_prune=force_prune)
+
+    def export_archives(self, query, path, format="jsonl", compression=None,
+                        descriptors=None, page_size=1000):
+        """Export the metadata of the archives matching a query to a file.
+
+        The API response is decoded and written page by page, without
+        creating Archive objects, so that memory usage stays bounded even
+        for a full-catalogue export. Descriptors are flattened into columns.
+
+        Args:
+            query: mongoDB query (e.g. {category: "MY_CAT"}), {} for all archives
+            path (str): output file
+            format (str): (optional) "jsonl", "csv" or "parquet" (requires pyarrow)
+            compression (str): (optional) "gzip", "bz2" or "xz" for jsonl and
+                csv (inferred from the extension of path if not given),
+                codec name for parquet (e.g. "snappy", "zstd")
+            descriptors (List[str]): (optional) descriptor columns of csv and
+                parquet exports. Defaults to the descriptors of the queried
+                category, or of all categories.
+            page_size (int): (optional) number of archives written at once
+
+        Returns:
+            (int) number of exported archives
+        """
+        from .export import ArchiveExporter
+        return ArchiveExporter(self).export(query, path, format=format,
+                                            compression=compression,
+                                            descriptors=descriptors,
+                                            page_size=page_size)
+
+
+# AstrClient of a worker process of Browser.map_archives
+_worker_client = None
+
+
+def _init_worker(astrclient):
+    """Initialize a worker process of Browser.map_archives with its client."""
+    global _worker_client
+    _worker_client = astrclient
+
+
+def _download_and_process(task):
+    """Download and extract an archive, then process it (worker of Browser.map_archives).
+
+    Args:
+        task (tuple): function to call, index of the archive, archive and
+            local path (or None)
+
+    Returns:
+        (tuple) the index of the archive and the value returned by the function
+    """
+    import shutil
+    import tempfile
+    func, index, archive, local_path = task
+    archive._astrclient = _worker_client
+    if local_path is not None:
+        archive.download(local_path, extract=True)
+        return index, func(archive, os.path.join(local_path, archive.id_))
+    tmp_dir = tempfile.mkdtemp(prefix="libastr-")
+    try:
+        archive.download(tmp_dir, extract=True)
+        return index, func(archive, os.path.join(tmp_dir, archive.id_))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
 
 # - [ Archive ] --------------------------------------------------------------
 
@@ -289,6 +494,16 @@ class Archive(object):
                             'comments': self.comments,
                             'descriptors': self.descriptors}
 
+    def __getstate__(self):
+        # The logger is not picklable, it is rebuilt on unpickling
+        state = self.__dict__.copy()
+        del state["_logger"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._logger = get_logger(self.__class__.__name__)
+
     def __repr__(self):
         return "<{}.{}, id={}>\n{}".format(__name__,
                                            self.__class__.__name__,
@@ -345,18 +560,31 @@ class Archive(object):
         self._astrclient.send_post("archives/id/" + self.id_,
                                    params=body_request)
 
-    def upload(self, file_paths):
+    def upload(self, file_paths, validator=None, chunked=False, part_size=None,
+               progress=None):
         """Upload this archive to ASTR.
 
         Args:
             file_paths: list of all the files to upload in the zip
                    (e.g. ["/home/john.doe/Desktop/file_1.txt",
                           "/home/john.doe/Desktop/file_2.png"])
+            validator (DescriptorValidator): (optional) if given, the date
+                and descriptors are checked locally against the cached
+                category before anything is sent to the server.
+            chunked (bool): (optional) if True, the zip is sent in parts
+                through a resumable session (see AstrClient.upload_chunked()).
+                Recommended for large archives.
+            part_size (int): (optional) size of the parts in bytes, if chunked
+            progress (callable): (optional) called with the number of bytes
+                sent and the total size after each part, if chunked
 
         Raises:
             PathError: if the given file paths are not valid.
+            ValidationError: if the archive does not match its category.
             ArchiveError: if an error occured while adding the new archive
               to the ASTR database.
+            UploadError: if a chunked upload failed. The archive id is set,
+              and the error token can be given to AstrClient.resume_upload().
             Other exceptions: same than AstrClient.upload()
         """
         filenames = []
@@ -374,6 +602,8 @@ class Archive(object):
                                     os.path.basename(path)))
             else:
                 filenames.append(os.path.basename(path))
+        if validator is not None:
+            validator.check_archives([self])
 
         data = self._object_to_dict()
         data['author'] = self._astrclient.get_username()
@@ -382,21 +612,30 @@ class Archive(object):
             raise ArchiveError(res)
         else:
             archive_id = res['archive']['_id']
-            self._astrclient.upload(uri="upload",
-                                    paths=file_paths,
-                                    zip_name=archive_id)
-            self.id_ = archive_id
+            if chunked:
+                self.id_ = archive_id
+                self._astrclient.upload_chunked(paths=file_paths,
+                                                zip_name=archive_id,
+                                                part_size=part_size,
+                                                progress=progress)
+            else:
+                self._astrclient.upload(uri="upload",
+                                        paths=file_paths,
+                                        zip_name=archive_id)
+                self.id_ = archive_id
 
-    def replace_zip(self, file_paths):
+    def replace_zip(self, file_paths, chunked=False, part_size=None, progress=None):
         """Replace the zip file of this archive with a new one.
 
         Args:
             file_paths: list of all the files to upload in the zip
                (e.g. ["/home/john.doe/Desktop/file_1.txt",
                       "/home/john.doe/Desktop/file_2.png"])
+            chunked, part_size, progress: (optional) same than Archive.upload()
 
         Raises:
             PathError: if given file paths are not valid.
+            UploadError: if a chunked upload failed.
             Other exceptions: Same than AstrClient.upload()
         """
         filenames = []
@@ -417,9 +656,16 @@ class Archive(object):
         self._astrclient.send_post("archives/id/" + self.id_,
                                    params={"newArchive": "true"})
         # upload new files
-        self._astrclient.upload(uri="upload/replace-zip",
-                                paths=file_paths,
-                                zip_name=self.id_)
+        if chunked:
+            self._astrclient.upload_chunked(paths=file_paths,
+                                            zip_name=self.id_,
+                                            part_size=part_size,
+                                            progress=progress,
+                                            replace=True)
+        else:
+            self._astrclient.upload(uri="upload/replace-zip",
+                                    paths=file_paths,
+                                    zip_name=self.id_)
 
 
     def download(self, local_path, extract=False):
@@ -440,10 +686,19 @@ class Archive(object):
         """
         if not os.path.isdir(local_path):
             raise PathError("{} is not a valid directory".format(local_path))
+        # With a coalescing client, concurrent downloads of this archive to the
+        # same place share the download and the extraction
+        key = ("ARCHIVE", self.id_, os.path.abspath(local_path), extract)
+        self._astrclient.coalesce(key, self._download, local_path, extract)
+
+    def _download(self, local_path, extract):
+        """Download the archive to a local directory, see Archive.download()."""
         path_to_zip = os.path.join(local_path, self.id_ + '.zip')
         self._astrclient.download(uri="download/id/" + self.id_, path=path_to_zip)
-        
+
         if extract:
+            import shutil
+            import zipfile
             archive_folder = os.path.join(local_path, self.id_)
             # If the folder to extract files already exists, remove it and its content.
             if os.path.isdir(archive_folder):
@@ -475,6 +730,16 @@ class ArchiveCategory(object):
                             'author': self.author,
                             'descriptors': self.descriptors}
 
+    def __getstate__(self):
+        # The logger is not picklable, it is rebuilt on unpickling
+        state = self.__dict__.copy()
+        del state["_logger"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._logger = get_logger(self.__class__.__name__)
+
     def __repr__(self):
         return "<{}.{}, id={}>\n{}".format(__name__,
                                            self.__class__.__name__,
@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""libastr request scheduler to share an ASTR server between workers.
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+import heapq
+import itertools
+import os
+import threading
+import time
+import weakref
+from contextlib import asynccontextmanager, contextmanager
+
+from .logger import get_logger
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_DEFAULT = 1
+PRIORITY_BULK = 2
+
+# Schedulers of this process, reset in forked children whose locks may be
+# held by threads which do not exist anymore
+_schedulers = weakref.WeakSet()
+
+
+# - [ Scheduler ] ------------------------------------------------------------
+
+class RequestScheduler(object):
+    """Token-bucket rate limiter, concurrency cap and priority queue.
+
+    A single scheduler can be shared by several AstrClient instances, threads
+    and asyncio tasks. Waiting requests are served by priority class first
+    (lower value first), then in arrival order.
+    """
+
+    def __init__(self, rate=None, burst=None, max_concurrency=None):
+        """Initialize a RequestScheduler.
+
+        Args:
+            rate (float): (optional) Maximum number of requests started per
+                second. No rate limit if None.
+            burst (int): (optional) Size of the token bucket, i.e. number of
+                requests which can be started at once after an idle period.
+                Defaults to max(1, rate).
+            max_concurrency (int): (optional) Maximum number of requests in
+                flight at the same time. No limit if None.
+        """
+        if rate is not None and rate <= 0:
+            raise ValueError("rate must be strictly positive: {}".format(rate))
+        if max_concurrency is not None and max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1: {}".format(max_concurrency))
+        self._logger = get_logger(self.__class__.__name__)
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1, int(rate or 1))
+        self.max_concurrency = max_concurrency
+        self._reset()
+        _schedulers.add(self)
+
+    def _reset(self):
+        """(Re)create the synchronisation primitives and the counters."""
+        self._condition = threading.Condition()
+        self._waiters = []
+        self._counter = itertools.count()
+        self._tokens = float(self.burst)
+        self._last_refill = time.monotonic()
+        self._active = 0
+        self._stats = {}
+        # Queue entry of each waiting asyncio task -> (event loop, asyncio.Event)
+        self._async_waiters = {}
+
+    def __getstate__(self):
+        # Only the configuration is pickled, a fresh queue is built on unpickling
+        return {"rate": self.rate,
+                "burst": self.burst,
+                "max_concurrency": self.max_concurrency}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._logger = get_logger(self.__class__.__name__)
+        self._reset()
+        _schedulers.add(self)
+
+    def __repr__(self):
+        return "<{}.{}, rate={}, burst={}, max_concurrency={}>".format(
+            __name__, self.__class__.__name__,
+            self.rate, self.burst, self.max_concurrency)
+
+    # - [ Token bucket ] -----------------------------------------------------
+
+    def _refill(self):
+        """Add the tokens earned since the last refill. Lock must be held."""
+        if self.rate is None:
+            return
+        now = time.monotonic()
+        self._tokens = min(float(self.burst),
+                           self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def _delay_before_start(self):
+        """Return how long the head of the queue must still wait. Lock must be held.
+
+        Returns:
+            (float) 0 if a request can start now, the time until the next token
+              otherwise, or None if only a release can unblock the queue.
+        """
+        if self.max_concurrency is not None and self._active >= self.max_concurrency:
+            return None
+        if self.rate is None:
+            return 0
+        self._refill()
+        if self._tokens >= 1:
+            return 0
+        return (1 - self._tokens) / self.rate
+
+    # - [ Acquire / Release ] ------------------------------------------------
+
+    def _notify(self):
+        """Wake up the waiting threads and asyncio tasks. Lock must be held."""
+        self._condition.notify_all()
+        for loop, event in self._async_waiters.values():
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # The event loop of this waiter is closed
+                pass
+
+    def _start(self, entry, start):
+        """Take the slot of the head of the queue. Lock must be held.
+
+        Returns:
+            (float) number of seconds spent waiting
+        """
+        heapq.heappop(self._waiters)
+        if self.rate is not None:
+            self._tokens -= 1
+        self._active += 1
+        waited = time.monotonic() - start
+        self._record_wait(entry[0], waited)
+        # Let the next waiter check whether it can start too
+        self._notify()
+        return waited
+
+    def _abandon(self, entry):
+        """Remove a waiter from the queue. Lock must be held."""
+        self._waiters.remove(entry)
+        heapq.heapify(self._waiters)
+        self._notify()
+
+    def acquire(self, priority=PRIORITY_DEFAULT, timeout=None):
+        """Block until a request of the given priority is allowed to start.
+
+        Args:
+            priority (int): priority class, lower values are served first
+                (e.g. PRIORITY_INTERACTIVE, PRIORITY_BULK)
+            timeout (float): (optional) maximum number of seconds to wait
+
+        Returns:
+            (float) number of seconds spent waiting
+
+        Raises:
+            TimeoutError: if the slot was not obtained before the timeout.
+        """
+        start = time.monotonic()
+        deadline = None if timeout is None else start + timeout
+        with self._condition:
+            entry = (priority, next(self._counter))
+            heapq.heappush(self._waiters, entry)
+            try:
+                while True:
+                    delay = None
+                    if self._waiters[0] == entry:
+                        delay = self._delay_before_start()
+                        if delay == 0:
+                            break
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise TimeoutError("No request slot available after {}s".format(timeout))
+                        delay = remaining if delay is None else min(delay, remaining)
+                    self._condition.wait(delay)
+            except BaseException:
+                self._abandon(entry)
+                raise
+            return self._start(entry, start)
+
+    def release(self):
+        """Signal that a request previously started with acquire() is over."""
+        with self._condition:
+            self._active -= 1
+            self._notify()
+
+    @contextmanager
+    def slot(self, priority=PRIORITY_DEFAULT, timeout=None):
+        """Context manager wrapping acquire() and release().
+
+        Args:
+            priority (int): priority class of the request
+            timeout (float): (optional) maximum number of seconds to wait
+        """
+        self.acquire(priority, timeout=timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire_async(self, priority=PRIORITY_DEFAULT, timeout=None):
+        """Asyncio version of acquire(), waiting without blocking the event loop.
+
+        asyncio tasks wait in the same queue as threads and share the same
+        limits. If the task is cancelled while waiting, it simply leaves the
+        queue.
+
+        Args:
+            priority (int): priority class of the request
+            timeout (float): (optional) maximum number of seconds to wait
+
+        Returns:
+            (float) number of seconds spent waiting
+
+        Raises:
+            TimeoutError: if the slot was not obtained before the timeout.
+        """
+        import asyncio
+        start = time.monotonic()
+        deadline = None if timeout is None else start + timeout
+        event = asyncio.Event()
+        with self._condition:
+            entry = (priority, next(self._counter))
+            heapq.heappush(self._waiters, entry)
+            self._async_waiters[entry] = (asyncio.get_running_loop(), event)
+        try:
+            while True:
+                with self._condition:
+                    delay = None
+                    if self._waiters[0] == entry:
+                        delay = self._delay_before_start()
+                        if delay == 0:
+                            del self._async_waiters[entry]
+                            return self._start(entry, start)
+                    # Cleared with the lock held, so that no wake-up is missed
+                    event.clear()
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError("No request slot available after {}s".format(timeout))
+                    delay = remaining if delay is None else min(delay, remaining)
+                try:
+                    await asyncio.wait_for(event.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            with self._condition:
+                self._async_waiters.pop(entry, None)
+                self._abandon(entry)
+            raise
+
+    @asynccontextmanager
+    async def slot_async(self, priority=PRIORITY_DEFAULT, timeout=None):
+        """Asyncio context manager wrapping acquire_async() and release().
+
+        Args:
+            priority (int): priority class of the request
+            timeout (float): (optional) maximum number of seconds to wait
+        """
+        await self.acquire_async(priority, timeout=timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    # - [ Metrics ] ----------------------------------------------------------
+
+    def _record_wait(self, priority, waited):
+        """Update the wait-time statistics of a priority class. Lock must be held."""
+        stats = self._stats.setdefault(priority, {"requests": 0,
+                                                  "total_wait": 0.0,
+                                                  "max_wait": 0.0})
+        stats["requests"] += 1
+        stats["total_wait"] += waited
+        stats["max_wait"] = max(stats["max_wait"], waited)
+
+    def queue_depth(self, priority=None):
+        """Get the number of requests waiting for a slot.
+
+        Args:
+            priority (int): (optional) only count the waiters of this class
+
+        Returns:
+            (int) number of waiting requests
+        """
+        with self._condition:
+            if priority is None:
+                return len(self._waiters)
+            return sum(1 for waiter in self._waiters if waiter[0] == priority)
+
+    def get_metrics(self):
+        """Get a snapshot of the scheduler metrics.
+
+        Returns:
+            (dict) queue depth, number of active requests, available tokens
+              and wait-time statistics per priority class
+              (e.g. {"queue_depth": 3, "active": 4, "tokens": 0.5,
+                     "priorities": {0: {"requests": 12, "queue_depth": 0,
+                                        "total_wait": 0.1, "mean_wait": 0.008,
+                                        "max_wait": 0.05}}})
+        """
+        with self._condition:
+            self._refill()
+            priorities = {}
+            for priority in set(self._stats) | set(w[0] for w in self._waiters):
+                stats = dict(self._stats.get(priority, {"requests": 0,
+                                                         "total_wait": 0.0,
+                                                         "max_wait": 0.0}))
+                stats["mean_wait"] = (stats["total_wait"] / stats["requests"]
+                                      if stats["requests"] else 0.0)
+                stats["queue_depth"] = sum(1 for w in self._waiters if w[0] == priority)
+                priorities[priority] = stats
+            return {"queue_depth": len(self._waiters),
+                    "active": self._active,
+                    "tokens": self._tokens if self.rate is not None else None,
+                    "priorities": priorities}
+
+
+def _reset_schedulers_after_fork():
+    for scheduler in list(_schedulers):
+        scheduler._reset()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_schedulers_after_fork)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""libastr single-flight helper to coalesce identical concurrent calls.
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+import copy
+import os
+import threading
+import weakref
+
+# Instances of this process, reset in forked children whose locks may be
+# held by threads which do not exist anymore
+_instances = weakref.WeakSet()
+
+
+# - [ Helpers ] --------------------------------------------------------------
+
+def _copy_error(error):
+    """Copy an exception, so that each waiter raises its own object.
+
+    Raising modifies the traceback of the exception, which must not be shared
+    between threads. The copy starts from the traceback of the original.
+    """
+    try:
+        error_copy = copy.copy(error)
+    except Exception:
+        # __init__ does not accept the args of the exception (e.g. UploadError)
+        try:
+            error_copy = error.__class__.__new__(error.__class__, *error.args)
+            error_copy.__dict__.update(error.__dict__)
+        except Exception:
+            return error
+    error_copy.__cause__ = error.__cause__
+    error_copy.__context__ = error.__context__
+    error_copy.__suppress_context__ = error.__suppress_context__
+    return error_copy.with_traceback(error.__traceback__)
+
+
+# - [ Single flight ] --------------------------------------------------------
+
+class _Call(object):
+    """A call in flight, shared by its caller and all the waiters."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """Execute only once the identical calls made at the same time.
+
+    The first caller of a given key executes the function, the callers
+    arriving with the same key while it is running wait and receive the same
+    result (or exception). Nothing is cached once the call is over.
+    """
+
+    def __init__(self):
+        self._reset()
+        _instances.add(self)
+
+    def __getstate__(self):
+        # Calls in flight belong to the current process, nothing to pickle
+        return {}
+
+    def __setstate__(self, state):
+        self._reset()
+        _instances.add(self)
+
+    def _reset(self):
+        """(Re)create the lock, the calls in flight and the counters."""
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._executed = 0
+        self._deduplicated = 0
+
+    def do(self, key, func, *args, **kwargs):
+        """Call func(*args, **kwargs), or wait for the identical call in flight.
+
+        Args:
+            key (hashable): identifier of the call
+            func (callable): function to execute
+            args, kwargs: arguments given to func
+
+        Returns:
+            The result of func. Waiters receive a deep copy of it, so that
+            callers can modify their result independently.
+
+        Raises:
+            Any exception raised by func, to the caller and a copy of it to
+            each waiter.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self._deduplicated += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self._executed += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise _copy_error(call.error)
+            return copy.deepcopy(call.result)
+
+        try:
+            call.result = func(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def get_stats(self):
+        """Get the coalescing statistics.
+
+        Returns:
+            (dict) number of executed calls, of deduplicated calls and of
+              calls currently in flight
+              (e.g. {"executed": 10, "deduplicated": 32, "in_flight": 1})
+        """
+        with self._lock:
+            return {"executed": self._executed,
+                    "deduplicated": self._deduplicated,
+                    "in_flight": len(self._calls)}
+
+
+def _reset_after_fork():
+    for instance in list(_instances):
+        instance._reset()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
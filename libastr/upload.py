@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""libastr resumable chunked upload sessions.
+
+The zip of the archive is built locally and sent in fixed-size parts:
+
+    POST upload/sessions                      {"archiveId", "size", "sha256",
+                                               "partSize", "replace", "key"}
+                                              -> {"sessionId": "..."}
+    GET  upload/sessions/<sessionId>          -> {"parts": [0, 1, ...]}
+    POST upload/sessions/<sessionId>/parts/<index>   (raw bytes of the part)
+    POST upload/sessions/<sessionId>/commit   {"sha256"}
+
+The key is generated by the client, and the server returns the existing
+session when a session with the same key was already created, so that the
+creation can be retried when its response is lost. The server assembles the
+parts, checks the size and sha256 of the zip on commit, and stores it as the
+zip of the archive.
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+import hashlib
+import os
+import time
+import uuid
+
+import requests
+
+from .logger import get_logger
+from .exceptions import *
+
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+MAX_RETRIES = 5
+RETRY_DELAY = 1.0
+
+
+# - [ Upload session ] -------------------------------------------------------
+
+class UploadSession(object):
+    """Resumable upload of the zip of an archive in fixed-size parts."""
+
+    def __init__(self, astrclient, archive_id, zip_path, size, sha256,
+                 part_size=DEFAULT_PART_SIZE, session_id=None, replace=False,
+                 max_retries=MAX_RETRIES, key=None):
+        """Initialize an UploadSession.
+
+        Users should rather use UploadSession.create() or
+        UploadSession.from_token().
+
+        Args:
+            astrclient (AstrClient): client used to send the requests
+            archive_id (str): id of the archive receiving the zip
+            zip_path (str): path of the local zip to upload
+            size (int): size of the zip in bytes
+            sha256 (str): hexadecimal sha256 of the zip
+            part_size (int): (optional) size of the parts in bytes
+            session_id (str): (optional) id of the session on the server,
+                None if the session was not started yet
+            replace (bool): (optional) True to replace the zip of an
+                existing archive
+            max_retries (int): (optional) number of retries of each part
+            key (str): (optional) idempotency key of the session creation,
+                generated if not given
+        """
+        self._logger = get_logger(self.__class__.__name__)
+        self._astrclient = astrclient
+        self.archive_id = archive_id
+        self.zip_path = zip_path
+        self.size = size
+        self.sha256 = sha256
+        self.part_size = part_size
+        self.session_id = session_id
+        self.replace = replace
+        self.max_retries = max_retries
+        self.key = key or uuid.uuid4().hex
+
+    @classmethod
+    def create(cls, astrclient, archive_id, paths, part_size=None, replace=False,
+               zip_path=None):
+        """Zip the files locally and prepare their upload.
+
+        Args:
+            astrclient (AstrClient): client used to send the requests
+            archive_id (str): id of the archive receiving the zip
+            paths (List[str]): list of files paths to put in the zip
+            part_size (int): (optional) size of the parts in bytes
+            replace (bool): (optional) True to replace the zip of an
+                existing archive
+            zip_path (str): (optional) where to write the local zip. It is
+                kept until the upload is committed, so that it can be resumed.
+                Defaults to a file in the temporary directory.
+
+        Returns:
+            (UploadSession) session ready to be uploaded
+        """
+        import tempfile
+        import zipfile
+        if zip_path is None:
+            fd, zip_path = tempfile.mkstemp(prefix="libastr-{}-".format(archive_id),
+                                            suffix=".zip")
+            os.close(fd)
+        with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zip_file:
+            for path in paths:
+                zip_file.write(path, arcname=os.path.basename(path))
+        sha256 = hashlib.sha256()
+        with open(zip_path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                sha256.update(block)
+        return cls(astrclient, archive_id, zip_path,
+                   size=os.path.getsize(zip_path),
+                   sha256=sha256.hexdigest(),
+                   part_size=part_size or DEFAULT_PART_SIZE,
+                   replace=replace)
+
+    @classmethod
+    def from_token(cls, astrclient, token):
+        """Restore a session from a resume token.
+
+        Args:
+            astrclient (AstrClient): client used to send the requests
+            token (dict): resume token returned by to_token()
+
+        Returns:
+            (UploadSession) session to resume
+
+        Raises:
+            PathError: if the local zip of the session does not exist anymore.
+        """
+        if not os.path.isfile(token["zipPath"]):
+            raise PathError("{} is not a file, the upload cannot be resumed"
+                            .format(token["zipPath"]))
+        return cls(astrclient, token["archiveId"], token["zipPath"],
+                   size=token["size"],
+                   sha256=token["sha256"],
+                   part_size=token["partSize"],
+                   session_id=token["sessionId"],
+                   replace=token["replace"],
+                   key=token.get("key"))
+
+    def to_token(self):
+        """Get a JSON serializable resume token of this session.
+
+        Returns:
+            (dict) resume token, to be given to from_token()
+        """
+        return {"archiveId": self.archive_id,
+                "zipPath": self.zip_path,
+                "size": self.size,
+                "sha256": self.sha256,
+                "partSize": self.part_size,
+                "sessionId": self.session_id,
+                "replace": self.replace,
+                "key": self.key}
+
+    @property
+    def nb_parts(self):
+        """(int) number of parts of the zip."""
+        return max(1, (self.size + self.part_size - 1) // self.part_size)
+
+    # - [ Requests ] ---------------------------------------------------------
+
+    def _with_retries(self, func, *args, **kwargs):
+        """Call func, retrying on connection errors and server errors.
+
+        Returns:
+            The result of func
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                return func(*args, **kwargs)
+            except (requests.ConnectionError, requests.Timeout, HTTPError) as e:
+                response = getattr(e, "response", None)
+                if isinstance(e, HTTPError) and response is not None and response.status_code < 500:
+                    raise
+                if attempt == self.max_retries:
+                    raise
+                delay = RETRY_DELAY * 2 ** attempt
+                self._logger.warning("{}, retrying in {}s".format(e, delay))
+                time.sleep(delay)
+
+    def _start(self):
+        """Open the session on the server.
+
+        Retrying is safe thanks to the key: a retried creation which already
+        reached the server returns the same session instead of a new one.
+        """
+        res = self._with_retries(self._astrclient.send_post, "upload/sessions",
+                                 params={"archiveId": self.archive_id,
+                                         "size": self.size,
+                                         "sha256": self.sha256,
+                                         "partSize": self.part_size,
+                                         "replace": self.replace,
+                                         "key": self.key})
+        self.session_id = res["sessionId"]
+
+    def _received_parts(self):
+        """Get the indexes of the parts already received by the server."""
+        res = self._with_retries(self._astrclient.send_get,
+                                 "upload/sessions/" + self.session_id)
+        return set(res["parts"])
+
+    def _send_part(self, f, index):
+        """Read a part of the zip and send it."""
+        f.seek(index * self.part_size)
+        data = f.read(self.part_size)
+        self._with_retries(self._astrclient.send_bytes,
+                           "upload/sessions/{}/parts/{}".format(self.session_id, index),
+                           data)
+        return len(data)
+
+    def upload(self, progress=None):
+        """Send the missing parts and commit the session.
+
+        Args:
+            progress (callable): (optional) called with the number of bytes
+                sent and the total size after each part
+
+        Raises:
+            UploadError: if the upload failed, its token attribute can be
+              persisted to resume the upload later.
+        """
+        try:
+            if self.session_id is None:
+                self._start()
+                received = set()
+            else:
+                received = self._received_parts()
+            sent = sum(min(self.part_size, self.size - index * self.part_size)
+                       for index in received)
+            if progress is not None:
+                progress(sent, self.size)
+            with open(self.zip_path, "rb") as f:
+                for index in range(self.nb_parts):
+                    if index in received:
+                        continue
+                    sent += self._send_part(f, index)
+                    if progress is not None:
+                        progress(sent, self.size)
+            self._with_retries(self._astrclient.send_post,
+                               "upload/sessions/{}/commit".format(self.session_id),
+                               params={"sha256": self.sha256})
+        except (requests.RequestException, KeyError) as e:
+            msg = "Upload of archive {} failed: {}".format(self.archive_id, e)
+            self._logger.error(msg)
+            raise UploadError(msg, self.to_token()) from e
+        os.remove(self.zip_path)
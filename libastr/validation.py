@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""libastr local validation of archives against their category before upload.
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+import datetime
+import threading
+
+from requests import HTTPError
+
+from .logger import get_logger
+from .exceptions import ValidationError
+
+DATE_FORMAT = "%Y-%m-%d"
+
+
+# - [ Validator ] ------------------------------------------------------------
+
+class DescriptorValidator(object):
+    """Check archives against the descriptors of their category.
+
+    Categories are fetched from ASTR once and cached, so that thousands of
+    pending archives can be checked without any request to the server.
+    """
+
+    def __init__(self, astrclient=None):
+        """Initialize a DescriptorValidator.
+
+        Args:
+            astrclient (AstrClient): (optional) A AstrClient instance to
+                fetch the categories. If no parameter is given a new
+                AstrClient instance will be created.
+        """
+        from .resources import Browser
+        self._logger = get_logger(self.__class__.__name__)
+        self._browser = Browser(astrclient)
+        self._categories = {}
+        self._lock = threading.Lock()
+
+    # - [ Categories cache ] -------------------------------------------------
+
+    def get_category(self, name):
+        """Get an archive category from the cache, fetching it if needed.
+
+        Only a 404 error or an empty response mean that the category does not
+        exist. Other errors are raised and the category is not cached, so that
+        it is fetched again on the next call.
+
+        Args:
+            name (str): archive category name (e.g. MY_CAT)
+
+        Returns:
+            (ArchiveCategory) the category, or None if it does not exist
+        """
+        with self._lock:
+            if name in self._categories:
+                return self._categories[name]
+        try:
+            json_object = self._browser._astrclient.send_get("categories/name/" + name)
+        except HTTPError as e:
+            if e.response is None or e.response.status_code != 404:
+                raise
+            json_object = None
+        if json_object:
+            category = self._browser._json_to_archive_category(json_object)
+        else:
+            self._logger.warning("Unknown archive category {!r}".format(name))
+            category = None
+        with self._lock:
+            self._categories[name] = category
+        return category
+
+    def prefetch(self, names):
+        """Fill the cache with the given categories.
+
+        If more than one category is missing, all categories are fetched in a
+        single request.
+
+        Args:
+            names (iterable): archive category names
+        """
+        with self._lock:
+            missing = set(names) - set(self._categories)
+        if len(missing) == 1:
+            self.get_category(missing.pop())
+        elif missing:
+            categories = self._browser.get_all_archive_categories()
+            with self._lock:
+                for category in categories:
+                    self._categories[category.name] = category
+                for name in missing:
+                    self._categories.setdefault(name, None)
+
+    def clear_cache(self):
+        """Forget the cached categories, e.g. after a category was modified."""
+        with self._lock:
+            self._categories.clear()
+
+    # - [ Validation ] -------------------------------------------------------
+
+    def validate(self, archive):
+        """Check an archive against the descriptors of its category.
+
+        Args:
+            archive (Archive): archive to check
+
+        Returns:
+            (List[str]) error messages, empty if the archive is valid
+        """
+        errors = []
+        try:
+            datetime.datetime.strptime(str(archive.date), DATE_FORMAT)
+        except ValueError:
+            errors.append("invalid date {!r}, expected YYYY-MM-DD".format(archive.date))
+
+        category = self.get_category(archive.category)
+        if category is None:
+            errors.append("unknown category {!r}".format(archive.category))
+            return errors
+
+        descriptors = archive.descriptors or {}
+        for name, options in category.descriptors.items():
+            value = descriptors.get(name)
+            if value is None or value == "":
+                errors.append("missing descriptor {!r}".format(name))
+            elif options and value not in options:
+                errors.append("invalid value {!r} for descriptor {!r}, expected one of {}"
+                              .format(value, name, options))
+        for name in descriptors:
+            if name not in category.descriptors:
+                errors.append("unknown descriptor {!r} for category {!r}"
+                              .format(name, category.name))
+        return errors
+
+    def validate_archives(self, archives):
+        """Check a batch of archives, fetching each category at most once.
+
+        Args:
+            archives (List[Archive]): archives to check
+
+        Returns:
+            (dict) index of each invalid archive in the list -> list of error
+              messages. Empty if all archives are valid.
+        """
+        self.prefetch(set(archive.category for archive in archives))
+        errors = {}
+        for index, archive in enumerate(archives):
+            archive_errors = self.validate(archive)
+            if archive_errors:
+                errors[index] = archive_errors
+        return errors
+
+    def check_archives(self, archives):
+        """Check a batch of archives and raise if any of them is invalid.
+
+        Args:
+            archives (List[Archive]): archives to check
+
+        Raises:
+            ValidationError: if at least one archive is invalid. Its errors
+              attribute gives the errors of each invalid archive.
+        """
+        errors = self.validate_archives(archives)
+        if errors:
+            self._logger.error("{} invalid archive(s) out of {}".format(len(errors), len(archives)))
+            raise ValidationError(errors)
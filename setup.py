@@ -17,6 +17,15 @@ setuptools.setup(
     long_description=long_description,
     author='Softbank Robotics Europe',
     packages=['libastr'],
+    extras_require={
+        "frame": ["numpy"],
+        "parquet": ["pyarrow"],
+    },
+    entry_points={
+        "console_scripts": [
+            "astr = libastr.cli:main",
+        ],
+    },
     url="https://github.com/aldebaran/lib-python-astr",
     license="MPL-2.0",
     classifiers=[
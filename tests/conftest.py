@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Stand-in ASTR server shared by the tests.
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+import io
+import json
+import threading
+import time
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+
+def make_archive(i, category="MY_CAT", **descriptors):
+    """Build an archive as returned by the ASTR API."""
+    return {"_id": "id{}".format(i), "author": "John DOE", "date": "2018-06-20",
+            "category": category, "comments": "",
+            "descriptors": [{"name": name, "value": value}
+                            for name, value in descriptors.items()]}
+
+
+def make_category(name, **descriptors):
+    """Build an archive category as returned by the ASTR API."""
+    return {"_id": "cat-" + name, "name": name, "author": "John DOE",
+            "descriptors": [{"name": descriptor, "options": options}
+                            for descriptor, options in descriptors.items()]}
+
+
+def make_zip(files):
+    """Build a zip in memory from a dict of file name -> text."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zip_file:
+        for name, text in files.items():
+            zip_file.writestr(name, text)
+    return buffer.getvalue()
+
+
+class AstrStandIn(ThreadingHTTPServer):
+    """Minimal ASTR API: archives, categories, queries, downloads and deletions.
+
+    Attributes:
+        archives (List[dict]): archives of the server
+        categories (List[dict]): archive categories of the server
+        zips (dict): archive id -> zip content, built from the id if missing
+        requests (List[tuple]): (method, path) of every received request
+        errors (dict): path -> status code returned instead of the response
+        delay (float): seconds waited before each response
+    """
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _AstrHandler)
+        self.archives = []
+        self.categories = []
+        self.zips = {}
+        self.requests = []
+        self.errors = {}
+        self.delay = 0.0
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}/".format(self.server_port)
+
+    def count(self, method, path):
+        """Number of received requests with this method and path (after /api/)."""
+        return self.requests.count((method, path))
+
+    def get_zip(self, id_):
+        if id_ not in self.zips:
+            self.zips[id_] = make_zip({"data.txt": "content of " + id_})
+        return self.zips[id_]
+
+    def query(self, query):
+        """Archives matching the top-level fields of a mongoDB query."""
+        return [archive for archive in self.archives
+                if all(archive.get(key) == value for key, value in query.items()
+                       if not key.startswith("$"))]
+
+
+class _AstrHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, body, status=200, content_type="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _reply(self, obj, status=200):
+        self._send(json.dumps(obj).encode("utf-8"), status)
+
+    def _handle(self, method):
+        server = self.server
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length).decode("utf-8")) if length else None
+        path = self.path.split("/api/", 1)[1]
+        server.requests.append((method, path))
+        if server.delay:
+            time.sleep(server.delay)
+        if path in server.errors:
+            return self._reply({"error": "injected"}, server.errors[path])
+
+        parts = path.split("/")
+        archives = {archive["_id"]: archive for archive in server.archives}
+        categories = {category["name"]: category for category in server.categories}
+        if method == "GET" and path == "archives":
+            return self._reply(server.archives)
+        if method == "POST" and path == "archives":
+            return self._reply(server.query(body or {}))
+        if method == "GET" and parts[:2] == ["archives", "id"] and parts[2] in archives:
+            return self._reply(archives[parts[2]])
+        if method == "DELETE" and parts[:2] == ["archives", "id"] and parts[2] in archives:
+            server.archives.remove(archives[parts[2]])
+            return self._reply({})
+        if method == "GET" and path == "categories":
+            return self._reply(server.categories)
+        if method == "GET" and parts[:2] == ["categories", "name"] and parts[2] in categories:
+            return self._reply(categories[parts[2]])
+        if method == "GET" and parts[:2] == ["download", "id"] and parts[2] in archives:
+            return self._send(server.get_zip(parts[2]), content_type="application/zip")
+        self._reply({"error": "not found"}, 404)
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+
+@pytest.fixture
+def astr_server():
+    server = AstrStandIn()
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05},
+                              daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def astr_client(astr_server):
+    pytest.importorskip("requests")
+    from libastr.client import AstrClient
+    return AstrClient(astr_server.url, "john@doe.com", "token")
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""astr command-line tool.
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+import io
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from libastr.cli import _Summary, _read_ids, _run_parallel, main
+
+from conftest import make_archive
+
+
+@pytest.fixture
+def summary(capsys):
+    return _Summary("test")
+
+
+def test_read_ids_from_arguments(summary):
+    assert list(_read_ids(["id0", "id1"], summary)) == ["id0", "id1"]
+
+
+def test_read_ids_from_stdin(summary, monkeypatch, capsys):
+    monkeypatch.setattr("sys.stdin", io.StringIO(
+        'id0\n\n{"_id": "id1", "author": "John DOE"}\n{"_id": broken\n{"author": "x"}\n  id2  \n'))
+    assert list(_read_ids(["-"], summary)) == ["id0", "id1", "id2"]
+    assert summary.failed == 2
+    assert capsys.readouterr().err.count("malformed line") == 2
+
+
+def test_run_parallel_bounded_look_ahead():
+    consumed = []
+    release = threading.Event()
+
+    def items():
+        for i in range(50):
+            consumed.append(i)
+            yield i
+
+    def func(item):
+        release.wait(5)
+        return item * 2
+
+    results = []
+    thread = threading.Thread(target=lambda: results.extend(_run_parallel(func, items(), 2)))
+    thread.start()
+    time.sleep(0.2)
+    # At most 2 * jobs items are consumed while all the jobs are blocked
+    assert len(consumed) == 4
+    release.set()
+    thread.join()
+    assert sorted(result for _, result, _ in results) == [i * 2 for i in range(50)]
+
+
+def test_run_parallel_errors():
+    def func(item):
+        if item == 1:
+            raise ValueError("bad item")
+        return item
+
+    results = {item: (result, error) for item, result, error in _run_parallel(func, range(3), 2)}
+    assert results[0] == (0, None) and results[2] == (2, None)
+    assert results[1][0] is None and isinstance(results[1][1], ValueError)
+
+
+# - [ Commands ] -------------------------------------------------------------
+
+@pytest.fixture
+def astr(astr_server):
+    pytest.importorskip("requests")
+
+    def run(*argv):
+        return main(["--url", astr_server.url, "--email", "john@doe.com", "--token", "token"]
+                    + list(argv))
+    return run
+
+
+def test_query(astr_server, astr, capsys):
+    astr_server.archives = [make_archive(0), make_archive(1, category="OTHER")]
+    assert astr("query", "--category", "MY_CAT") == 0
+    out, err = capsys.readouterr()
+    assert [json.loads(line)["_id"] for line in out.splitlines()] == ["id0"]
+    assert err.startswith("query: 1 succeeded, 0 failed")
+
+
+def test_download_exit_code_and_summary(astr_server, astr, capsys, monkeypatch, tmpdir):
+    astr_server.archives = [make_archive(0), make_archive(1)]
+    monkeypatch.setattr("sys.stdin", io.StringIO('{"_id": "id0"}\nmissing\nid1\n{not json\n'))
+    assert astr("download", str(tmpdir), "--extract", "-j", "2") == 1
+    out, err = capsys.readouterr()
+    assert sorted(json.loads(line)["_id"] for line in out.splitlines()) == ["id0", "id1"]
+    assert "download: 2 succeeded, 2 failed" in err
+    assert "malformed line" in err
+    assert sorted(os.listdir(str(tmpdir))) == ["id0", "id1"]
+
+
+def test_delete(astr_server, astr, capsys):
+    astr_server.archives = [make_archive(0), make_archive(1)]
+    assert astr("delete", "id0", "id1") == 0
+    assert astr_server.archives == []
+    assert "delete: 2 succeeded, 0 failed" in capsys.readouterr().err
+
+
+def test_command_error(astr, capsys, tmpdir):
+    assert astr("download", str(tmpdir.join("missing")), "id0") == 1
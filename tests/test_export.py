@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Streaming Json decoding and export of archive metadata.
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+import csv
+import gzip
+import json
+import os
+
+import pytest
+
+pytest.importorskip("requests")
+
+from libastr.client import _iter_json_array
+from libastr.exceptions import APIError
+from libastr.resources import Browser
+
+from conftest import make_archive, make_category
+
+DOCUMENT = [{"_id": "é1", "value": 12.5, "tags": ["a", "ü"]}, 3, "x,]", None, [1, [2]]]
+
+
+def _chunks(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+# - [ _iter_json_array ] -----------------------------------------------------
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 1000])
+def test_iter_json_array_chunk_sizes(size):
+    data = json.dumps(DOCUMENT, ensure_ascii=False).encode("utf-8")
+    assert list(_iter_json_array(_chunks(data, size))) == DOCUMENT
+
+
+def test_iter_json_array_number_split_across_chunks():
+    assert list(_iter_json_array([b"[12", b".5, 1", b"0", b"]"])) == [12.5, 10]
+    assert list(_iter_json_array([b" [ 12", b".5 ", b"]"])) == [12.5]
+
+
+def test_iter_json_array_utf8_split_across_chunks():
+    data = '["é€😀"]'.encode("utf-8")
+    # Split inside each multi-byte character
+    chunks = [data[:3], data[3:6], data[6:9], data[9:]]
+    assert list(_iter_json_array(chunks)) == ["é€😀"]
+
+
+def test_iter_json_array_is_lazy():
+    def chunks():
+        yield b'[{"a": 1},'
+        raise AssertionError("Read too far")
+    assert next(_iter_json_array(chunks())) == {"a": 1}
+
+
+@pytest.mark.parametrize("data", [b"[]", b" [ ] ", b"[\n]\n"])
+def test_iter_json_array_empty(data):
+    assert list(_iter_json_array(_chunks(data, 1))) == []
+
+
+@pytest.mark.parametrize("data", [b"", b'{"a": 1}', b"[1, 2", b'[{"a": 1}', b'[1, {"a"'])
+def test_iter_json_array_errors(data):
+    with pytest.raises(APIError):
+        list(_iter_json_array(_chunks(data, 1)))
+
+
+# - [ Export ] ---------------------------------------------------------------
+
+@pytest.fixture
+def browser(astr_server, astr_client):
+    astr_server.categories = [make_category("MY_CAT", my_desc=["A"], size=[], tags=[],
+                                            date=[])]
+    astr_server.archives = [make_archive(0, my_desc="A", size=12.5, tags=["x", "y"]),
+                            make_archive(1, my_desc="Ü", size=3, date="2018-07-01"),
+                            make_archive(2, category="OTHER")]
+    return Browser(astr_client)
+
+
+COLUMNS = ["_id", "author", "date", "category", "comments",
+           "descriptors.date", "my_desc", "size", "tags"]
+ROWS = [["id0", "John DOE", "2018-06-20", "MY_CAT", "", "", "A", "12.5", '["x", "y"]'],
+        ["id1", "John DOE", "2018-06-20", "MY_CAT", "", "2018-07-01", "Ü", "3", ""]]
+
+
+def test_export_jsonl(browser, tmpdir):
+    path = str(tmpdir.join("export.jsonl.gz"))
+    assert browser.export_archives({"category": "MY_CAT"}, path, page_size=1) == 2
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    assert records[0]["size"] == 12.5 and records[0]["tags"] == ["x", "y"]
+    assert records[1]["descriptors.date"] == "2018-07-01"
+    assert [record["_id"] for record in records] == ["id0", "id1"]
+    assert os.listdir(str(tmpdir)) == ["export.jsonl.gz"]
+
+
+def test_export_csv(browser, tmpdir):
+    path = str(tmpdir.join("export.csv"))
+    assert browser.export_archives({"category": "MY_CAT"}, path, format="csv") == 2
+    with open(path, newline="", encoding="utf-8") as f:
+        rows = list(csv.reader(f))
+    assert rows == [COLUMNS] + ROWS
+
+
+def test_export_parquet(browser, tmpdir):
+    pytest.importorskip("pyarrow")
+    import pyarrow.parquet
+    path = str(tmpdir.join("export.parquet"))
+    assert browser.export_archives({"category": "MY_CAT"}, path, format="parquet",
+                                   page_size=1) == 2
+    table = pyarrow.parquet.read_table(path)
+    assert table.column_names == COLUMNS
+    assert [[value or "" for value in row.values()] for row in table.to_pylist()] == ROWS
+    assert table.to_pylist()[1]["tags"] is None
+
+
+def test_failed_export_leaves_no_file(astr_server, browser, tmpdir):
+    path = str(tmpdir.join("export.csv"))
+    from requests import HTTPError
+    astr_server.errors["archives"] = 500
+    with pytest.raises(HTTPError):
+        browser.export_archives({"category": "MY_CAT"}, path, format="csv",
+                                descriptors=["my_desc"])
+    assert os.listdir(str(tmpdir)) == []
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""ArchiveFrame filtering, aggregation and joins.
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from libastr.frame import ArchiveFrame
+
+
+def _archive(i, **descriptors):
+    return {"_id": "id{}".format(i), "author": "John DOE", "date": "2018-06-20",
+            "category": "C{}".format(i % 2), "comments": "",
+            "descriptors": [{"name": name, "value": value}
+                            for name, value in descriptors.items()]}
+
+
+@pytest.fixture
+def frame():
+    return ArchiveFrame.from_json([_archive(i, d="v{}".format(i % 3), sn=i % 4,
+                                            tags=["a", "b"] if i % 2 else ["c"])
+                                   for i in range(12)])
+
+
+def test_where(frame):
+    selected = frame.where(category="C1", d=["v1", "v2"])
+    assert list(selected["_id"]) == ["id1", "id5", "id7", "id11"]
+    # Chained filters reuse the codes of the parent frame
+    assert list(selected.where(sn=3)["_id"]) == ["id7", "id11"]
+    assert len(frame.where(d="unknown")) == 0
+
+
+def test_groupby_count(frame):
+    assert frame.groupby_count("category", "d") == {("C0", "v0"): 2, ("C0", "v1"): 2,
+                                                    ("C0", "v2"): 2, ("C1", "v0"): 2,
+                                                    ("C1", "v1"): 2, ("C1", "v2"): 2}
+    # Values without any selected row are not reported
+    assert frame.where(d="v0").value_counts("category") == {"C0": 2, "C1": 2}
+
+
+def test_unhashable_values(frame):
+    assert frame.value_counts("tags") == {("a", "b"): 6, ("c",): 6}
+    assert frame.isin("tags", [["c"]]).sum() == 6
+
+
+def test_scalar_index(frame):
+    assert list(frame[0]["_id"]) == ["id0"]
+    assert list(frame[np.int64(-1)]["_id"]) == ["id11"]
+    with pytest.raises(IndexError):
+        frame[12]
+
+
+def test_join_drops_missing_keys():
+    left = ArchiveFrame.from_json([_archive(0, sn=1), _archive(1), _archive(2, sn=2)])
+    right = ArchiveFrame.from_json([_archive(3, sn=2), _archive(4), _archive(5, sn=2)])
+    joined = left.join(right, "sn")
+    assert list(joined["_id"]) == ["id2", "id2"]
+    assert list(joined["_id_right"]) == ["id3", "id5"]
+
+
+def test_join_keeps_descriptors_of_both_frames(astr_client):
+    left = ArchiveFrame.from_json([_archive(0, sn=1, color="red")], astrclient=astr_client)
+    right = ArchiveFrame.from_json([_archive(1, sn=1, color="blue", size="L")])
+    joined = left.join(right, "sn")
+    assert joined.descriptor_names == ["sn", "color", "color_right", "size"]
+    archive, = joined.to_archives()
+    assert archive.id_ == "id0"
+    assert archive.descriptors == {"sn": 1, "color": "red", "color_right": "blue", "size": "L"}
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Import-time budget of libastr.
+
+Importing requests takes most of the cold start of a Browser query (about
+120 ms, versus about 2 ms for libastr itself once compiled). The budget is
+therefore checked on top of requests, measured in the same interpreter.
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Time of "from libastr import Browser" once requests is imported. Generous,
+# so that it holds even when the bytecode of libastr must be compiled.
+BROWSER_IMPORT_BUDGET = 0.05
+
+# Dependencies which must not be imported by "import libastr"
+HEAVY_MODULES = ("requests", "multiprocessing", "numpy", "pyarrow", "libastr.client")
+
+# Dependencies which must not be imported by "from libastr import Browser"
+DEFERRED_MODULES = ("multiprocessing", "zipfile", "shutil", "tempfile", "numpy", "pyarrow",
+                    "concurrent.futures", "libastr.singleflight", "libastr.upload")
+
+
+def _run(code):
+    """Run code in a fresh interpreter and return its stdout."""
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    return subprocess.run([sys.executable, "-c", code], env=env, check=True,
+                          stdout=subprocess.PIPE, universal_newlines=True).stdout
+
+
+def test_import_does_not_load_heavy_dependencies():
+    code = ("import sys, libastr\n"
+            "print(','.join(m for m in {!r} if m in sys.modules))".format(HEAVY_MODULES))
+    assert _run(code).strip() == ""
+
+
+def test_browser_import_time_budget():
+    pytest.importorskip("requests")
+    code = ("import json, sys, time\n"
+            "start = time.perf_counter()\n"
+            "import requests\n"
+            "baseline = time.perf_counter()\n"
+            "before = set(sys.modules)\n"
+            "from libastr import Browser\n"
+            "end = time.perf_counter()\n"
+            "print(json.dumps({'requests': baseline - start, 'libastr': end - baseline,\n"
+            "                  'modules': sorted(set(sys.modules) - before)}))")
+    runs = [json.loads(_run(code)) for _ in range(5)]
+    # Best of several runs, to be robust to a loaded machine
+    best = min(run["libastr"] for run in runs)
+    assert best < BROWSER_IMPORT_BUDGET, (
+        "from libastr import Browser took {:.1f} ms on top of requests ({:.1f} ms)"
+        .format(best * 1000, min(run["requests"] for run in runs) * 1000))
+    loaded = [name for name in DEFERRED_MODULES if name in runs[0]["modules"]]
+    assert loaded == []
+
+
+def test_lazy_attributes():
+    pytest.importorskip("requests")
+    code = ("import libastr\n"
+            "from libastr import Browser, AstrClient, RequestScheduler\n"
+            "print(Browser.__module__, AstrClient.__module__, 'Browser' in dir(libastr))")
+    assert _run(code).split() == ["libastr.resources", "libastr.client", "True"]
+
+
+def test_unknown_attribute():
+    import libastr
+    with pytest.raises(AttributeError):
+        libastr.DoesNotExist
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Incremental mirror against a stand-in ASTR server.
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+import json
+import os
+
+import pytest
+
+pytest.importorskip("requests")
+
+from libastr.mirror import MANIFEST_NAME, STAGING_NAME
+from libastr.resources import Browser
+
+from conftest import make_archive, make_zip
+
+QUERY = {"category": "MY_CAT"}
+
+
+@pytest.fixture
+def browser(astr_server, astr_client):
+    astr_server.archives = [make_archive(i) for i in range(5)]
+    return Browser(astr_client)
+
+
+def _downloads(astr_server):
+    return sorted(path for method, path in astr_server.requests
+                  if path.startswith("download/"))
+
+
+def _content(root, id_):
+    with open(os.path.join(root, id_, "data.txt")) as f:
+        return f.read()
+
+
+def _manifest(root):
+    with open(os.path.join(root, MANIFEST_NAME)) as f:
+        return json.load(f)["archives"]
+
+
+def test_rerun_downloads_nothing(astr_server, browser, tmpdir):
+    root = str(tmpdir)
+    result = browser.mirror(QUERY, root, jobs=2)
+    assert (result["downloaded"], result["failed"]) == (5, {})
+    assert sorted(os.listdir(root)) == [MANIFEST_NAME] + ["id{}".format(i) for i in range(5)]
+    del astr_server.requests[:]
+
+    result = browser.mirror(QUERY, root)
+    assert (result["downloaded"], result["unchanged"], result["updated"]) == (0, 5, 0)
+    assert _downloads(astr_server) == []
+
+
+def test_replaced_zip_is_downloaded(astr_server, browser, tmpdir):
+    root = str(tmpdir)
+    browser.mirror(QUERY, root)
+    del astr_server.requests[:]
+    # Replacing the zip sets a modification date on the archive
+    astr_server.archives[1]["lastModified"] = "2018-07-01T12:00:00"
+    astr_server.zips["id1"] = make_zip({"data.txt": "new content"})
+
+    result = browser.mirror(QUERY, root)
+    assert (result["downloaded"], result["unchanged"]) == (1, 4)
+    assert _downloads(astr_server) == ["download/id/id1"]
+    assert _content(root, "id1") == "new content"
+
+
+def test_metadata_change_updates_the_manifest_only(astr_server, browser, tmpdir):
+    root = str(tmpdir)
+    browser.mirror(QUERY, root)
+    del astr_server.requests[:]
+    astr_server.archives[2]["comments"] = "checked"
+    astr_server.archives[3]["descriptors"] = [{"name": "my_desc", "value": "B"}]
+
+    result = browser.mirror(QUERY, root)
+    assert (result["downloaded"], result["unchanged"], result["updated"]) == (0, 5, 2)
+    assert _downloads(astr_server) == []
+    assert browser.mirror(QUERY, root)["updated"] == 0
+
+
+def test_prune(astr_server, browser, tmpdir):
+    root = str(tmpdir)
+    browser.mirror(QUERY, root)
+    del astr_server.archives[1:4]
+
+    result = browser.mirror(QUERY, root)
+    # Small numbers of archives are pruned without force_prune
+    assert (result["pruned"], result["kept"]) == (3, 0)
+    assert sorted(os.listdir(root)) == [MANIFEST_NAME, "id0", "id4"]
+    assert sorted(_manifest(root)) == ["id0", "id4"]
+
+
+def test_prune_guard(astr_server, browser, tmpdir):
+    root = str(tmpdir)
+    astr_server.archives = [make_archive(i) for i in range(12)]
+    browser.mirror(QUERY, root)
+    # e.g. a category renamed on the server: the query matches nothing
+    astr_server.archives = []
+
+    result = browser.mirror(QUERY, root)
+    assert (result["pruned"], result["kept"]) == (0, 12)
+    assert len(_manifest(root)) == 12
+    assert len(os.listdir(root)) == 13
+
+    result = browser.mirror(QUERY, root, force_prune=True)
+    assert (result["pruned"], result["kept"]) == (12, 0)
+    assert os.listdir(root) == [MANIFEST_NAME]
+
+
+def test_no_prune(astr_server, browser, tmpdir):
+    root = str(tmpdir)
+    browser.mirror(QUERY, root)
+    del astr_server.archives[0]
+    result = browser.mirror(QUERY, root, prune=False)
+    assert (result["pruned"], result["kept"]) == (0, 0)
+    assert "id0" in _manifest(root)
+
+
+def test_failed_download_is_retried_next_run(astr_server, browser, tmpdir):
+    root = str(tmpdir)
+    astr_server.errors["download/id/id2"] = 500
+    result = browser.mirror(QUERY, root)
+    assert (result["downloaded"], list(result["failed"])) == (4, ["id2"])
+    assert "id2" not in _manifest(root)
+    assert not os.path.exists(os.path.join(root, STAGING_NAME))
+
+    del astr_server.errors["download/id/id2"]
+    del astr_server.requests[:]
+    result = browser.mirror(QUERY, root)
+    assert (result["downloaded"], result["failed"]) == (1, {})
+    assert _downloads(astr_server) == ["download/id/id2"]
+
+
+def test_restart_after_interruption(astr_server, browser, tmpdir):
+    root = str(tmpdir)
+    browser.mirror(QUERY, root)
+    # State left by a process killed while fetching id3 and id4: id3 was moved
+    # in place but the manifest was not saved yet, id4 is partially staged
+    manifest = _manifest(root)
+    del manifest["id3"], manifest["id4"]
+    with open(os.path.join(root, MANIFEST_NAME), "w") as f:
+        json.dump({"query": QUERY, "archives": manifest}, f)
+    os.remove(os.path.join(root, "id3", "data.txt"))
+    os.makedirs(os.path.join(root, STAGING_NAME))
+    os.rename(os.path.join(root, "id4"), os.path.join(root, STAGING_NAME, "id4"))
+    del astr_server.requests[:]
+
+    result = browser.mirror(QUERY, root)
+    assert (result["downloaded"], result["unchanged"]) == (2, 3)
+    assert _downloads(astr_server) == ["download/id/id3", "download/id/id4"]
+    assert _content(root, "id3") == "content of id3"
+    assert _content(root, "id4") == "content of id4"
+    assert sorted(os.listdir(root)) == [MANIFEST_NAME] + ["id{}".format(i) for i in range(5)]
+    assert sorted(_manifest(root)) == ["id{}".format(i) for i in range(5)]
+
+
+def test_switch_to_zips(astr_server, browser, tmpdir):
+    root = str(tmpdir)
+    browser.mirror(QUERY, root)
+    result = browser.mirror(QUERY, root, extract=False)
+    assert result["downloaded"] == 5
+    assert sorted(os.listdir(root)) == [MANIFEST_NAME] + ["id{}.zip".format(i) for i in range(5)]
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Pickling of the resources and processing of archives in a pool of processes.
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+import os
+import pickle
+
+import pytest
+
+pytest.importorskip("requests")
+
+from libastr.client import AstrClient
+from libastr.exceptions import ResourceNotFound
+from libastr.resources import Archive, ArchiveCategory, Browser
+from libastr.scheduler import RequestScheduler
+
+from conftest import make_archive
+
+
+def _read_data(archive, folder):
+    """Function run by the workers of map_archives."""
+    with open(os.path.join(folder, "data.txt")) as f:
+        return os.getpid(), f.read()
+
+
+def test_pickle_client(astr_server):
+    astr_server.archives = [make_archive(0)]
+    client = AstrClient(astr_server.url, "john@doe.com", "token", coalesce=True,
+                        scheduler=RequestScheduler(rate=100, max_concurrency=2))
+    client.send_get("archives")
+    copy = pickle.loads(pickle.dumps(client))
+    assert copy.headers == client.headers
+    assert copy.scheduler.max_concurrency == 2
+    assert copy._session is None
+    assert copy.send_get("archives/id/id0")["_id"] == "id0"
+
+
+def test_pickle_resources(astr_client):
+    archive = Archive(date="2018-06-20", category="MY_CAT", descriptors={"my_desc": "A"},
+                      id_="id0", astrclient=astr_client)
+    copy = pickle.loads(pickle.dumps(archive))
+    assert (copy.id_, copy.date, copy.descriptors) == ("id0", "2018-06-20", {"my_desc": "A"})
+    assert copy._astrclient.url == astr_client.url
+    category = ArchiveCategory("cat", "MY_CAT", "John DOE", {"my_desc": ["A"]},
+                               astrclient=astr_client)
+    copy = pickle.loads(pickle.dumps(category))
+    assert (copy.name, copy.descriptors) == ("MY_CAT", {"my_desc": ["A"]})
+
+
+def test_one_session_per_process(astr_client, monkeypatch):
+    session = astr_client._get_session()
+    assert astr_client._get_session() is session
+    # As seen from a forked child
+    pid = os.getpid()
+    monkeypatch.setattr(os, "getpid", lambda: pid + 1)
+    assert astr_client._get_session() is not session
+
+
+def test_connection_pool_sized_to_the_scheduler(astr_server):
+    client = AstrClient(astr_server.url, "john@doe.com", "token",
+                        scheduler=RequestScheduler(max_concurrency=32))
+    assert client._get_session().get_adapter(astr_server.url)._pool_maxsize == 32
+
+
+def test_map_archives(astr_server, astr_client):
+    astr_server.archives = [make_archive(i) for i in range(6)]
+    browser = Browser(astr_client)
+    archives = browser.get_all_archives()
+    results = list(browser.map_archives(_read_data, archives, processes=2, ordered=True))
+    assert [archive.id_ for archive, _ in results] == [archive.id_ for archive in archives]
+    assert [text for _, (_, text) in results] == ["content of id{}".format(i) for i in range(6)]
+    pids = set(pid for _, (pid, _) in results)
+    assert os.getpid() not in pids and len(pids) <= 2
+    assert astr_server.count("GET", "download/id/id0") == 1
+
+
+def test_map_archives_keeps_files(astr_server, astr_client, tmpdir):
+    astr_server.archives = [make_archive(i) for i in range(3)]
+    browser = Browser(astr_client)
+    results = browser.map_archives(_read_data, browser.get_all_archives(), processes=2,
+                                   local_path=str(tmpdir))
+    assert sorted(archive.id_ for archive, _ in results) == ["id0", "id1", "id2"]
+    assert sorted(os.listdir(str(tmpdir))) == ["id0", "id1", "id2"]
+
+
+def test_map_archives_error(astr_server, astr_client):
+    missing = Archive(date=None, category=None, descriptors={}, id_="missing",
+                      astrclient=astr_client)
+    with pytest.raises(ResourceNotFound):
+        list(Browser(astr_client).map_archives(_read_data, [missing], processes=1))
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""RequestScheduler priorities, rate limit, asyncio waiters and metrics.
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+import asyncio
+import pickle
+import threading
+import time
+
+import pytest
+
+from libastr.scheduler import (RequestScheduler, PRIORITY_BULK, PRIORITY_DEFAULT,
+                               PRIORITY_INTERACTIVE)
+
+
+def _wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.001)
+
+
+def test_priority_order():
+    scheduler = RequestScheduler(max_concurrency=1)
+    started = []
+
+    def request(priority, name):
+        with scheduler.slot(priority):
+            started.append(name)
+
+    scheduler.acquire()
+    threads = []
+    for priority, name in ((PRIORITY_BULK, "bulk 1"), (PRIORITY_DEFAULT, "default"),
+                           (PRIORITY_BULK, "bulk 2"), (PRIORITY_INTERACTIVE, "interactive")):
+        thread = threading.Thread(target=request, args=(priority, name))
+        thread.start()
+        threads.append(thread)
+        # Queue the requests in a known arrival order
+        _wait_for(lambda: scheduler.queue_depth() == len(threads))
+    scheduler.release()
+    for thread in threads:
+        thread.join()
+    assert started == ["interactive", "default", "bulk 1", "bulk 2"]
+
+
+def test_max_concurrency():
+    scheduler = RequestScheduler(max_concurrency=2)
+    scheduler.acquire()
+    scheduler.acquire()
+    with pytest.raises(TimeoutError):
+        scheduler.acquire(timeout=0.05)
+    assert scheduler.queue_depth() == 0
+    scheduler.release()
+    scheduler.acquire(timeout=0.05)
+
+
+def test_rate_pacing():
+    scheduler = RequestScheduler(rate=50, burst=1)
+    start = time.monotonic()
+    for _ in range(6):
+        with scheduler.slot():
+            pass
+    # The first request uses the initial token, each other one waits 1 / rate
+    assert time.monotonic() - start >= 5 / 50 * 0.9
+
+
+def test_burst():
+    scheduler = RequestScheduler(rate=1, burst=3)
+    start = time.monotonic()
+    for _ in range(3):
+        with scheduler.slot():
+            pass
+    assert time.monotonic() - start < 0.5
+    with pytest.raises(TimeoutError):
+        scheduler.acquire(timeout=0.05)
+
+
+def test_async_waiters_share_the_queue():
+    scheduler = RequestScheduler(max_concurrency=1)
+    started = []
+
+    async def request(priority, name):
+        async with scheduler.slot_async(priority):
+            started.append(name)
+            await asyncio.sleep(0)
+
+    async def main():
+        scheduler.acquire()
+        tasks = [asyncio.ensure_future(request(PRIORITY_BULK, "bulk")),
+                 asyncio.ensure_future(request(PRIORITY_INTERACTIVE, "interactive"))]
+        while scheduler.queue_depth() < 2:
+            await asyncio.sleep(0.001)
+        # Released from another thread, as a synchronous worker would
+        threading.Thread(target=scheduler.release).start()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    assert started == ["interactive", "bulk"]
+    assert scheduler.get_metrics()["active"] == 0
+
+
+def test_async_cancel_leaves_the_queue():
+    scheduler = RequestScheduler(max_concurrency=1)
+
+    async def main():
+        scheduler.acquire()
+        task = asyncio.ensure_future(scheduler.acquire_async(PRIORITY_INTERACTIVE))
+        while scheduler.queue_depth() < 1:
+            await asyncio.sleep(0.001)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        with pytest.raises(TimeoutError):
+            await scheduler.acquire_async(timeout=0.02)
+
+    asyncio.run(main())
+    metrics = scheduler.get_metrics()
+    assert metrics["queue_depth"] == 0
+    assert metrics["active"] == 1
+    assert scheduler._async_waiters == {}
+    # The cancelled waiter did not take the slot
+    scheduler.release()
+    scheduler.acquire(timeout=0.05)
+
+
+def test_metrics():
+    scheduler = RequestScheduler(rate=1000, max_concurrency=4)
+    for _ in range(3):
+        with scheduler.slot(PRIORITY_BULK):
+            pass
+    with scheduler.slot(PRIORITY_INTERACTIVE):
+        metrics = scheduler.get_metrics()
+    assert metrics["active"] == 1
+    assert metrics["queue_depth"] == 0
+    assert metrics["priorities"][PRIORITY_BULK]["requests"] == 3
+    assert metrics["priorities"][PRIORITY_INTERACTIVE]["requests"] == 1
+    bulk = metrics["priorities"][PRIORITY_BULK]
+    assert bulk["mean_wait"] == pytest.approx(bulk["total_wait"] / 3)
+    assert scheduler.get_metrics()["active"] == 0
+
+
+def test_pickle_keeps_configuration_only():
+    scheduler = RequestScheduler(rate=5, burst=2, max_concurrency=3)
+    scheduler.acquire()
+    copy = pickle.loads(pickle.dumps(scheduler))
+    assert (copy.rate, copy.burst, copy.max_concurrency) == (5, 2, 3)
+    assert copy.get_metrics()["active"] == 0
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""SingleFlight and request coalescing of AstrClient.
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from libastr.singleflight import SingleFlight
+
+from conftest import make_archive
+
+NB_CALLERS = 8
+
+
+def _concurrently(func, nb_callers=NB_CALLERS):
+    """Call func from several threads at once, return the results or exceptions."""
+    barrier = threading.Barrier(nb_callers)
+
+    def call():
+        barrier.wait()
+        try:
+            return func()
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=nb_callers) as executor:
+        return [future.result() for future in [executor.submit(call)
+                                               for _ in range(nb_callers)]]
+
+
+def _slow(result, started, release):
+    started.set()
+    release.wait(5)
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+# - [ SingleFlight ] ---------------------------------------------------------
+
+def test_identical_calls_are_executed_once():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def func():
+        calls.append(1)
+        return _slow({"values": [1, 2]}, started, release)
+
+    threading.Timer(0.2, release.set).start()
+    results = _concurrently(lambda: flight.do("key", func))
+    assert len(calls) == 1
+    assert all(result == {"values": [1, 2]} for result in results)
+    # Waiters receive copies, which can be modified independently
+    assert len(set(id(result) for result in results)) == NB_CALLERS
+    assert flight.get_stats() == {"executed": 1, "deduplicated": NB_CALLERS - 1,
+                                  "in_flight": 0}
+
+
+def test_nothing_is_cached():
+    flight = SingleFlight()
+    calls = []
+    for _ in range(3):
+        flight.do("key", calls.append, 1)
+    assert len(calls) == 3
+    assert flight.get_stats()["deduplicated"] == 0
+
+
+def test_errors_are_copied_for_each_waiter():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    error = ValueError("failed")
+    threading.Timer(0.2, release.set).start()
+    errors = _concurrently(lambda: flight.do("key", _slow, error, started, release))
+    assert all(isinstance(e, ValueError) and e.args == ("failed",) for e in errors)
+    # The caller raises the original, each waiter its own copy
+    assert len(set(id(e) for e in errors)) == NB_CALLERS
+    assert sum(1 for e in errors if e is error) == 1
+
+
+# - [ AstrClient coalescing ] ------------------------------------------------
+
+@pytest.fixture
+def coalescing_client(astr_server):
+    pytest.importorskip("requests")
+    from libastr.client import AstrClient
+    astr_server.archives = [make_archive(0), make_archive(1)]
+    # Responses are slow enough for all the callers to overlap
+    astr_server.delay = 0.2
+    return AstrClient(astr_server.url, "john@doe.com", "token", coalesce=True)
+
+
+def test_coalesced_get(astr_server, coalescing_client):
+    results = _concurrently(lambda: coalescing_client.send_get("archives/id/id0"))
+    assert all(result["_id"] == "id0" for result in results)
+    assert astr_server.count("GET", "archives/id/id0") == 1
+    assert coalescing_client.get_stats()["coalescing"]["deduplicated"] == NB_CALLERS - 1
+
+
+def test_coalesced_query(astr_server, coalescing_client):
+    from libastr.resources import Browser
+    browser = Browser(coalescing_client)
+    results = _concurrently(lambda: browser.get_archives_by_mongodb_query(
+        {"category": "MY_CAT"}))
+    assert all(len(result) == 2 for result in results)
+    assert astr_server.count("POST", "archives") == 1
+
+
+def test_other_posts_are_not_coalesced(astr_server, coalescing_client):
+    _concurrently(lambda: coalescing_client.send_post("archives", params={}), nb_callers=3)
+    assert astr_server.count("POST", "archives") == 3
+
+
+def test_coalesced_archive_download(astr_server, coalescing_client, tmpdir):
+    from libastr.resources import Archive
+    archive = Archive(date=None, category=None, descriptors={}, id_="id1",
+                      astrclient=coalescing_client)
+    results = _concurrently(lambda: archive.download(str(tmpdir), extract=True))
+    assert results == [None] * NB_CALLERS
+    assert astr_server.count("GET", "download/id/id1") == 1
+    assert os.listdir(str(tmpdir.join("id1"))) == ["data.txt"]
+    assert not tmpdir.join("id1.zip").exists()
+
+
+def test_downloads_to_other_paths_are_not_coalesced(astr_server, coalescing_client, tmpdir):
+    paths = [str(tmpdir.join("{}.zip".format(i))) for i in range(3)]
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        list(executor.map(lambda path: coalescing_client.download("download/id/id0", path),
+                          paths))
+    assert astr_server.count("GET", "download/id/id0") == 3
+    assert all(os.path.getsize(path) > 0 for path in paths)
+
+
+def test_copied_errors_keep_their_attributes():
+    from libastr.exceptions import UploadError
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    threading.Timer(0.2, release.set).start()
+    errors = _concurrently(lambda: flight.do("key", _slow, UploadError("failed", {"id": 1}),
+                                             started, release), nb_callers=3)
+    assert [(type(e), str(e), e.token) for e in errors] == [(UploadError, "failed", {"id": 1})] * 3
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Resumable chunked uploads against a stand-in ASTR server.
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+import hashlib
+import io
+import json
+import os
+import threading
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("requests")
+
+import libastr.upload
+from libastr.client import AstrClient
+from libastr.exceptions import AuthenticationFailure, UploadError
+
+PART_SIZE = 64 * 1024
+
+
+class _UploadServer(ThreadingHTTPServer):
+    """Upload sessions endpoints, with injectable part failures.
+
+    Attributes:
+        sessions (dict): session id -> {"meta": creation parameters,
+            "parts": index -> bytes}
+        failures (List[int]): status codes returned, in order, instead of
+            storing the next parts
+        fail_part (tuple): (index, status) returned once for a given part
+        errors (dict): path -> status code returned instead of the response
+        drop_creation (int): number of session creations whose connection is
+            closed without response, after the session is created
+        part_requests (List[int]): indexes of all received part requests
+        paths (List[str]): paths (after /api/) of all received requests
+        creations (int): number of received session creations
+        stored (dict): archive id -> committed zip
+    """
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _UploadHandler)
+        self.sessions = {}
+        self.failures = []
+        self.fail_part = None
+        self.errors = {}
+        self.drop_creation = 0
+        self.part_requests = []
+        self.paths = []
+        self.creations = 0
+        self.stored = {}
+
+
+class _UploadHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, obj, status=200):
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = self.path.split("/api/", 1)[1]
+        self.server.paths.append(path)
+        if path in self.server.errors:
+            return self._reply({"error": "injected"}, self.server.errors[path])
+        session = self.server.sessions[self.path.rsplit("/", 1)[1]]
+        self._reply({"parts": sorted(session["parts"])})
+
+    def do_POST(self):
+        data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        path = self.path.split("/api/", 1)[1]
+        self.server.paths.append(path)
+        if path in self.server.errors:
+            return self._reply({"error": "injected"}, self.server.errors[path])
+        segments = path.split("/")
+        if segments[-2:] == ["upload", "sessions"]:
+            self.server.creations += 1
+            meta = json.loads(data.decode("utf-8"))
+            # Idempotent creation: the same key gives the same session
+            for session_id, session in self.server.sessions.items():
+                if session["meta"]["key"] == meta["key"]:
+                    break
+            else:
+                session_id = "s{}".format(len(self.server.sessions))
+                self.server.sessions[session_id] = {"meta": meta, "parts": {}}
+            if self.server.drop_creation:
+                self.server.drop_creation -= 1
+                self.close_connection = True
+                return
+            return self._reply({"sessionId": session_id})
+        session = self.server.sessions[segments[-3] if segments[-2] == "parts" else segments[-2]]
+        if segments[-2] == "parts":
+            index = int(segments[-1])
+            self.server.part_requests.append(index)
+            if self.server.failures:
+                return self._reply({"error": "injected"}, self.server.failures.pop(0))
+            if self.server.fail_part is not None and self.server.fail_part[0] == index:
+                status = self.server.fail_part[1]
+                self.server.fail_part = None
+                return self._reply({"error": "injected"}, status)
+            session["parts"][index] = data
+            return self._reply({})
+        # Commit: check the assembled zip against the announced size and sha256
+        blob = b"".join(session["parts"][i] for i in sorted(session["parts"]))
+        meta = session["meta"]
+        if (len(blob) != meta["size"] or hashlib.sha256(blob).hexdigest() != meta["sha256"]
+                or json.loads(data.decode("utf-8"))["sha256"] != meta["sha256"]):
+            return self._reply({"error": "checksum mismatch"}, 400)
+        self.server.stored[meta["archiveId"]] = blob
+        return self._reply({})
+
+
+@pytest.fixture
+def server():
+    server = _UploadServer()
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05},
+                              daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client(server, monkeypatch):
+    monkeypatch.setattr(libastr.upload, "RETRY_DELAY", 0.001)
+    return AstrClient("http://127.0.0.1:{}/".format(server.server_port), "john@doe.com", "token")
+
+
+@pytest.fixture
+def files(tmpdir):
+    paths = []
+    for name, size in (("f1", 300000), ("f2", 123456)):
+        path = str(tmpdir.join(name))
+        with open(path, "wb") as f:
+            f.write(os.urandom(size))
+        paths.append(path)
+    return paths
+
+
+def _names(blob):
+    return sorted(zipfile.ZipFile(io.BytesIO(blob)).namelist())
+
+
+def test_upload_retries_server_errors(server, client, files):
+    server.failures = [503, 503]
+    progress = []
+    client.upload_chunked(files, "A1", part_size=PART_SIZE,
+                          progress=lambda sent, total: progress.append((sent, total)))
+    assert _names(server.stored["A1"]) == ["f1", "f2"]
+    assert server.part_requests[:3] == [0, 0, 0]
+    assert progress[-1][0] == progress[-1][1] == server.sessions["s0"]["meta"]["size"]
+
+
+def test_failed_upload_gives_resume_token(server, client, files):
+    server.fail_part = (3, 400)
+    with pytest.raises(UploadError) as info:
+        client.upload_chunked(files, "A2", part_size=PART_SIZE)
+    token = json.loads(json.dumps(info.value.token))
+    assert token["sessionId"] == "s0"
+    assert os.path.isfile(token["zipPath"])
+    assert sorted(server.sessions["s0"]["parts"]) == [0, 1, 2]
+
+
+def test_resume_sends_missing_parts_only(server, client, files):
+    server.fail_part = (3, 400)
+    with pytest.raises(UploadError) as info:
+        client.upload_chunked(files, "A3", part_size=PART_SIZE)
+    token = info.value.token
+    del server.part_requests[:]
+
+    client.resume_upload(token)
+    nb_parts = (server.sessions["s0"]["meta"]["size"] + PART_SIZE - 1) // PART_SIZE
+    assert server.part_requests == list(range(3, nb_parts))
+    assert _names(server.stored["A3"]) == ["f1", "f2"]
+    assert not os.path.exists(token["zipPath"])
+
+
+def test_commit_checks_sha256(server, client, files):
+    server.fail_part = (3, 400)
+    with pytest.raises(UploadError) as info:
+        client.upload_chunked(files, "A4", part_size=PART_SIZE)
+    token = info.value.token
+    # The local zip changed since the session was created
+    with open(token["zipPath"], "r+b") as f:
+        f.seek(3 * PART_SIZE)
+        f.write(b"corrupted")
+
+    with pytest.raises(UploadError):
+        client.resume_upload(token)
+    assert "A4" not in server.stored
+    assert os.path.isfile(token["zipPath"])
+
+
+def test_authentication_failure_is_not_retried(server, client, files):
+    server.failures = [401]
+    with pytest.raises(UploadError) as info:
+        client.upload_chunked(files, "A5", part_size=PART_SIZE)
+    assert isinstance(info.value.__cause__, AuthenticationFailure)
+    assert server.part_requests == [0]
+
+
+def test_lost_session_creation_is_retried_once(server, client, files):
+    server.drop_creation = 1
+    client.upload_chunked(files, "A6", part_size=PART_SIZE)
+    assert server.creations == 2
+    assert list(server.sessions) == ["s0"]
+    assert _names(server.stored["A6"]) == ["f1", "f2"]
+
+
+@pytest.mark.parametrize("path", ["upload/sessions", "upload/sessions/s0",
+                                  "upload/sessions/s0/commit"])
+def test_authentication_failures_of_session_requests(server, client, files, path):
+    if path == "upload/sessions/s0":
+        # Parts are only listed when resuming
+        server.fail_part = (1, 400)
+        with pytest.raises(UploadError) as info:
+            client.upload_chunked(files, "A7", part_size=PART_SIZE)
+        resume = info.value.token
+    server.errors[path] = 401
+    with pytest.raises(UploadError) as info:
+        if path == "upload/sessions/s0":
+            client.resume_upload(resume)
+        else:
+            client.upload_chunked(files, "A7", part_size=PART_SIZE)
+    assert isinstance(info.value.__cause__, AuthenticationFailure)
+    assert info.value.__cause__.response.status_code == 401
+    # Not retried
+    assert server.paths.count(path) == 1
+    assert "A7" not in server.stored
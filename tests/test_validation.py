@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Local validation of archives against their category.
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+import pytest
+
+pytest.importorskip("requests")
+
+from requests import HTTPError
+
+from libastr.exceptions import ValidationError
+from libastr.resources import Archive
+from libastr.validation import DescriptorValidator
+
+from conftest import make_category
+
+
+@pytest.fixture
+def validator(astr_server, astr_client):
+    astr_server.categories = [make_category("MY_CAT", color=["red", "blue"], serial=[]),
+                              make_category("OTHER", size=[])]
+    return DescriptorValidator(astr_client)
+
+
+def _archive(client, category="MY_CAT", date="2018-06-20", **descriptors):
+    return Archive(date=date, category=category, descriptors=descriptors, astrclient=client)
+
+
+def test_valid_archive(validator, astr_client):
+    assert validator.validate(_archive(astr_client, color="red", serial="A1")) == []
+
+
+def test_invalid_archive(validator, astr_client):
+    errors = validator.validate(_archive(astr_client, date="20/06/2018", color="green",
+                                         extra="x"))
+    assert errors == ["invalid date '20/06/2018', expected YYYY-MM-DD",
+                      "invalid value 'green' for descriptor 'color', expected one of "
+                      "['red', 'blue']",
+                      "missing descriptor 'serial'",
+                      "unknown descriptor 'extra' for category 'MY_CAT'"]
+
+
+def test_unknown_category_is_cached(validator, astr_server, astr_client):
+    archive = _archive(astr_client, category="MISSING")
+    for _ in range(2):
+        assert validator.validate(archive) == ["unknown category 'MISSING'"]
+    assert astr_server.count("GET", "categories/name/MISSING") == 1
+
+
+def test_server_errors_are_not_cached(validator, astr_server):
+    astr_server.errors["categories/name/MY_CAT"] = 503
+    with pytest.raises(HTTPError):
+        validator.get_category("MY_CAT")
+    del astr_server.errors["categories/name/MY_CAT"]
+    assert validator.get_category("MY_CAT").name == "MY_CAT"
+    assert astr_server.count("GET", "categories/name/MY_CAT") == 2
+
+
+def test_batch_fetches_categories_once(validator, astr_server, astr_client):
+    archives = [_archive(astr_client, color="red", serial="A"),
+                _archive(astr_client, category="OTHER", size="L"),
+                _archive(astr_client, category="MISSING"),
+                _archive(astr_client, color="red")]
+    errors = validator.validate_archives(archives)
+    assert errors == {2: ["unknown category 'MISSING'"], 3: ["missing descriptor 'serial'"]}
+    assert astr_server.requests == [("GET", "categories")]
+
+    with pytest.raises(ValidationError) as info:
+        validator.check_archives(archives)
+    assert info.value.errors == errors
+    assert astr_server.requests == [("GET", "categories")]